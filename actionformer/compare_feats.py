@@ -0,0 +1,163 @@
+# python imports
+import argparse
+import os
+import time
+import pickle
+import tempfile
+from pprint import pprint
+
+# torch imports
+import torch
+import torch.nn as nn
+import torch.utils.data
+
+# our code
+from libs.core import load_config, load_feat_meta
+from libs.datasets import make_dataset, make_data_loader
+from libs.modeling import make_meta_arch
+from libs.utils import valid_one_epoch, ANETdetection, fix_random_seed
+
+
+################################################################################
+def folder_size(folder):
+    """total size (in bytes) of the files in a feature folder"""
+    total = 0
+    for root, _, files in os.walk(folder):
+        for f in files:
+            total += os.path.getsize(os.path.join(root, f))
+    return total
+
+def evaluate_feats(cfg, model, det_eval, print_freq):
+    """run the model on the val split with the given dataset cfg"""
+    val_dataset = make_dataset(
+        cfg['dataset_name'], False, cfg['val_split'], **cfg['dataset']
+    )
+    val_loader = make_data_loader(
+        val_dataset, False, None, 1, cfg['loader']['num_workers']
+    )
+    # save the raw results, and evaluate them here to get the mAP at each tIoU
+    with tempfile.TemporaryDirectory() as tmp_folder:
+        output_file = os.path.join(tmp_folder, 'eval_results.pkl')
+        start = time.time()
+        valid_one_epoch(
+            val_loader,
+            model,
+            -1,
+            output_file=output_file,
+            tb_writer=None,
+            print_freq=print_freq
+        )
+        run_time = time.time() - start
+        with open(output_file, "rb") as f:
+            results = pickle.load(f)
+    mAP, average_mAP, _ = det_eval.evaluate(results, verbose=False)
+    return mAP, average_mAP, run_time
+
+def load_model(cfg, ckpt_file):
+    """build the model of a config and load the EMA weights of a checkpoint"""
+    model = make_meta_arch(cfg['model_name'], **cfg['model'])
+    model = nn.DataParallel(model, device_ids=cfg['devices'])
+    print("=> loading checkpoint '{}'".format(ckpt_file))
+    checkpoint = torch.load(
+        ckpt_file,
+        map_location = lambda storage, loc: storage.cuda(cfg['devices'][0])
+    )
+    model.load_state_dict(checkpoint['state_dict_ema'])
+    del checkpoint
+    return model
+
+def main(args):
+    """compare the mAP of a model using two different feature stores"""
+    if os.path.isfile(args.config):
+        cfg = load_config(args.config)
+    else:
+        raise ValueError("Config file does not exist.")
+    assert len(cfg['val_split']) > 0, "Test set must be specified!"
+    assert os.path.isfile(args.ckpt), "CKPT file does not exist!"
+    pprint(cfg)
+
+    _ = fix_random_seed(0, include_cuda=True)
+
+    # model
+    model = load_model(cfg, args.ckpt)
+
+    # reference feats: the ones in the config file
+    ref_cfg = dict(cfg)
+    ref_cfg['dataset'] = dict(cfg['dataset'])
+    # test feats: the config file with a different feature store / dtype
+    test_cfg = dict(cfg)
+    test_cfg['dataset'] = dict(cfg['dataset'])
+    test_cfg['dataset']['feat_folder'] = args.feat_folder
+    test_cfg['dataset']['feat_backend'] = args.feat_backend
+    if args.feat_dtype is not None:
+        test_cfg['dataset']['feat_dtype'] = args.feat_dtype
+    # reduced feats (see reduce_feats.py, always .npz files) need their own model
+    feat_meta = load_feat_meta(args.feat_folder)
+    if feat_meta is not None:
+        test_cfg['dataset']['feat_backend'] = 'npz'
+        test_cfg['dataset']['file_ext'] = '.npz'
+        test_cfg['dataset']['input_dim'] = feat_meta['output_dim']
+        test_cfg['model'] = dict(cfg['model'])
+        test_cfg['model']['input_dim'] = feat_meta['output_dim']
+    if len(args.test_ckpt) > 0:
+        assert os.path.isfile(args.test_ckpt), "Test CKPT file does not exist!"
+        test_model = load_model(test_cfg, args.test_ckpt)
+    else:
+        assert test_cfg['model']['input_dim'] == cfg['model']['input_dim'], \
+            "Feats of a different dim need a model trained on them (--test-ckpt)"
+        test_model = model
+
+    # both runs share the same evaluator
+    val_dataset = make_dataset(
+        cfg['dataset_name'], False, cfg['val_split'], **cfg['dataset']
+    )
+    val_db_vars = val_dataset.get_attributes()
+    det_eval = ANETdetection(
+        val_dataset.json_file,
+        val_dataset.split[0],
+        tiou_thresholds = val_db_vars['tiou_thresholds']
+    )
+
+    print("\nEvaluating reference feats ({:s}) ...".format(ref_cfg['dataset']['feat_folder']))
+    ref_mAP, ref_avg, ref_time = evaluate_feats(ref_cfg, model, det_eval, args.print_freq)
+    print("\nEvaluating test feats ({:s}) ...".format(test_cfg['dataset']['feat_folder']))
+    test_mAP, test_avg, test_time = evaluate_feats(test_cfg, test_model, det_eval, args.print_freq)
+
+    # report
+    ref_size = folder_size(ref_cfg['dataset']['feat_folder'])
+    test_size = folder_size(test_cfg['dataset']['feat_folder'])
+    block = '[RESULTS] reference vs test feats'
+    for tiou, ref, test in zip(val_db_vars['tiou_thresholds'], ref_mAP, test_mAP):
+        block += '\n|tIoU = {:.2f}: mAP = {:>5.2f} vs {:>5.2f} (%), diff = {:>+5.2f} (%)'.format(
+            tiou, ref * 100, test * 100, (test - ref) * 100)
+    block += '\nAverage mAP: {:>5.2f} vs {:>5.2f} (%), diff = {:>+5.2f} (%)'.format(
+        ref_avg * 100, test_avg * 100, (test_avg - ref_avg) * 100)
+    block += '\nFeats on disk: {:.2f} vs {:.2f} GB ({:.2f}x smaller)'.format(
+        ref_size / 1024 ** 3, test_size / 1024 ** 3, ref_size / max(test_size, 1))
+    block += '\nEval time: {:.2f} vs {:.2f} sec'.format(ref_time, test_time)
+    print(block)
+    return
+
+################################################################################
+if __name__ == '__main__':
+    """Entry Point"""
+    # the arg parser
+    parser = argparse.ArgumentParser(
+      description='Compare the mAP of a trained model using two feature stores (e.g., float32 vs int8 feats)')
+    parser.add_argument('config', type=str, metavar='DIR',
+                        help='path to a config file (reference feats)')
+    parser.add_argument('ckpt', type=str, metavar='DIR',
+                        help='path to a checkpoint file')
+    parser.add_argument('feat_folder', type=str, metavar='DIR',
+                        help='folder of the feats to compare against')
+    parser.add_argument('--feat-backend', default='mmap', type=str,
+                        help='feature store of the compared feats (default: mmap)')
+    parser.add_argument('--feat-dtype', default=None, type=str,
+                        help='dtype of the feats handed to the model (float32 | float16)')
+    parser.add_argument('--test-ckpt', default='', type=str,
+                        help='checkpoint used with the compared feats, e.g. a model '
+                             'trained on reduced feats (default: same as ckpt)')
+    parser.add_argument('-p', '--print-freq', default=10, type=int,
+                        help='print frequency (default: 10 iterations)')
+    args = parser.parse_args()
+    main(args)
@@ -1,3 +1,3 @@
-from .config import load_default_config, load_config
+from .config import load_default_config, load_config, load_feat_meta
 
-__all__ = ['load_default_config', 'load_config']
+__all__ = ['load_default_config', 'load_config', 'load_feat_meta']
@@ -1,3 +1,5 @@
+import os
+import json
 import yaml
 
 
@@ -37,6 +39,13 @@ DEFAULTS = {
     "loader": {
         "batch_size": 8,
         "num_workers": 4,
+        # set to a list of lengths (e.g., [256, 512, 1024]) to batch training
+        # videos of similar length together (after truncation)
+        "bucket_boundaries": None,
+        # pad / mask the training batches in the loader workers (and pin them)
+        "pad_in_workers": False,
+        # assign the targets of the training batches in the loader workers (needs pad_in_workers)
+        "targets_in_workers": False,
     },
     # network architecture
     "model": {
@@ -97,6 +106,9 @@ DEFAULTS = {
         "droppath": 0.1,
         # if to use label smoothing (>0.0)
         "label_smoothing": 0.0,
+        # if to pad each training batch to its longest input (rounded to the
+        # max stride of the model) instead of max_seq_len
+        "dynamic_padding": False,
         # weight parameter only for the mixed model, the higher it is the more relevance will be given to the MaxPooling branch
         "alpha": 0.5,
     },
@@ -145,7 +157,21 @@ def load_default_config():
     config = DEFAULTS
     return config
 
+def load_feat_meta(feat_folder):
+    # reduced feats (see reduce_feats.py) store their projection info next to them
+    if not isinstance(feat_folder, str):
+        return None
+    meta_file = os.path.join(feat_folder, "projection.json")
+    if not os.path.isfile(meta_file):
+        return None
+    with open(meta_file, "r") as fd:
+        return json.load(fd)
+
 def _update_config(config):
+    # input dim of reduced feats comes from their projection
+    feat_meta = load_feat_meta(config["dataset"].get("feat_folder"))
+    if feat_meta is not None:
+        config["dataset"]["input_dim"] = feat_meta["output_dim"]
     # fill in derived fields
     config["model"]["input_dim"] = config["dataset"]["input_dim"]
     config["model"]["num_classes"] = config["dataset"]["num_classes"]
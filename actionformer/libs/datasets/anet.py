@@ -8,7 +8,8 @@ from torch.utils.data import Dataset
 from torch.nn import functional as F
 
 from .datasets import register_dataset
-from .data_utils import truncate_feats
+from .data_utils import truncate_feats, load_cached_db
+from .feat_stores import make_feat_store
 from ..utils import remove_duplicate_annotations
 
 @register_dataset("anet")
@@ -30,7 +31,10 @@ class ActivityNetDataset(Dataset):
         num_classes,      # number of action categories
         file_prefix,      # feature file prefix if any
         file_ext,         # feature file extension if any
-        force_upsampling  # force to upsample to max_seq_len
+        force_upsampling, # force to upsample to max_seq_len
+        feat_backend='npy', # storage format of the feats (npy | mmap | pack), ignored for hdf5
+        feat_cache_gb=0,   # size of the shared feature cache in GB, 0 to disable
+        feat_cache=None    # a FeatCache shared with other datasets (overrides feat_cache_gb)
     ):
         # file path
         assert os.path.exists(feat_folder) and os.path.exists(json_file)
@@ -44,6 +48,9 @@ class ActivityNetDataset(Dataset):
             self.file_prefix = ''
         self.file_ext = file_ext
         self.json_file = json_file
+        if not self.use_hdf5:
+            self.feat_store = make_feat_store(
+                feat_backend, feat_folder, self.file_prefix, file_ext, feat_cache_gb, feat_cache)
 
         # anet uses fixed length features, make sure there is no downsampling
         self.force_upsampling = force_upsampling
@@ -82,6 +89,12 @@ class ActivityNetDataset(Dataset):
         return self.db_attributes
 
     def _load_json_db(self, json_file):
+        # parsed once, then loaded from the annotation cache
+        dict_db, label_dict = load_cached_db(
+            json_file, ('anet', tuple(sorted(self.split)), self.default_fps, self.num_classes == 1), self._parse_json_db)
+        return dict_db, label_dict
+
+    def _parse_json_db(self, json_file):
         # load database and select the subset
         with open(json_file, 'r') as fid:
             json_data = json.load(fid)
@@ -95,7 +108,7 @@ class ActivityNetDataset(Dataset):
                     label_dict[act['label']] = act['label_id']
 
         # fill in the db (immutable afterwards)
-        dict_db = tuple()
+        dict_db = []
         for key, value in json_db.items():
             # skip the video if not in the split
             if value['subset'].lower() not in self.split:
@@ -126,14 +139,14 @@ class ActivityNetDataset(Dataset):
             else:
                 segments = None
                 labels = None
-            dict_db += ({'id': key,
-                         'fps' : fps,
-                         'duration' : duration,
-                         'segments' : segments,
-                         'labels' : labels
-            }, )
+            dict_db.append({'id': key,
+                            'fps' : fps,
+                            'duration' : duration,
+                            'segments' : segments,
+                            'labels' : labels
+            })
 
-        return dict_db, label_dict
+        return tuple(dict_db), label_dict
 
     def __len__(self):
         return len(self.data_list)
@@ -152,9 +165,8 @@ class ActivityNetDataset(Dataset):
                     dtype=np.float32
                 )
         else:
-            filename = os.path.join(self.feat_folder,
-                                    self.file_prefix + video_item['id'] + self.file_ext)
-            feats = np.load(filename).astype(np.float32)
+            feats = np.asarray(
+                self.feat_store.open(video_item['id']), dtype=np.float32)
 
         # we support both fixed length features / variable length features
         # case 1: variable length features for training
@@ -240,6 +252,9 @@ class ActivityNetDataset(Dataset):
 
         # no truncation is needed
         # truncate the features during training
+        # (unlike the other datasets, the windows are not precomputed: the feature
+        # grid and the valid segments depend on the loaded feats, and with
+        # force_upsampling the feats are resized to max_seq_len, so nothing is cut)
         if self.is_training and (segments is not None):
             data_dict = truncate_feats(
                 data_dict, self.max_seq_len, self.trunc_thresh, feat_offset, self.crop_ratio
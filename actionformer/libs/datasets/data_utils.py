@@ -1,5 +1,7 @@
 import os
-import copy
+import json
+import bisect
+import hashlib
 import random
 import numpy as np
 import random
@@ -12,6 +14,258 @@ def trivial_batch_collator(batch):
     """
     return batch
 
+class PaddedBatchCollator(object):
+    """
+        A batch collator that pads / masks the feats in the data loader workers,
+        following the padding of the model (see PtTransformer.preprocessing)
+        Returns a dict that the model takes instead of a list of data dicts
+            'feats'      : B x C x T, padded with padding_val
+            'masks'      : B x 1 x T (bool)
+            'feats_lens' : B
+            'video_list' : the data dicts without their feats
+        and, with a target_assigner (see TargetAssigner in meta_archs.py),
+            'gt_cls_labels' : the (point, class) pairs of the positives of each video
+            'gt_offsets'    : the regression targets of the points of each video
+    """
+    def __init__(
+        self,
+        is_training,
+        max_seq_len,
+        max_div_factor,
+        dynamic_padding=False,
+        padding_val=0.0,
+        target_assigner=None
+    ):
+        self.is_training = is_training
+        self.max_seq_len = max_seq_len
+        self.max_div_factor = max_div_factor
+        self.dynamic_padding = dynamic_padding
+        self.padding_val = padding_val
+        self.target_assigner = target_assigner
+
+    def get_padded_len(self, max_len):
+        stride = self.max_div_factor
+        if self.is_training:
+            assert max_len <= self.max_seq_len, "Input length must be smaller than max_seq_len during training"
+            if self.dynamic_padding:
+                # pad to the longest input in the batch (rounded to the next divisible size)
+                return (max_len + (stride - 1)) // stride * stride
+            return self.max_seq_len
+        # pad to max_seq_len, or to the next divisible size
+        if max_len <= self.max_seq_len:
+            return self.max_seq_len
+        return (max_len + (stride - 1)) // stride * stride
+
+    def __call__(self, batch):
+        feats = [x['feats'] for x in batch]
+        feats_lens = torch.as_tensor([feat.shape[-1] for feat in feats])
+        max_len = self.get_padded_len(feats_lens.max(0).values.item())
+
+        # batch input shape B, C, T
+        batch_shape = [len(feats), feats[0].shape[0], max_len]
+        batched_inputs = feats[0].new_full(batch_shape, self.padding_val)
+        for feat, pad_feat in zip(feats, batched_inputs):
+            pad_feat[..., :feat.shape[-1]].copy_(feat)
+        batched_masks = torch.arange(max_len)[None, :] < feats_lens[:, None]
+
+        batch_dict = {'feats'      : batched_inputs,
+                      'masks'      : batched_masks.unsqueeze(1),
+                      'feats_lens' : feats_lens,
+                      # the feats are only sent once (in the batch)
+                      'video_list' : [{k: v for k, v in x.items() if k != 'feats'} for x in batch]}
+
+        # targets of the points after truncation / padding
+        if self.target_assigner is not None:
+            gt_cls_labels, gt_offsets = self.target_assigner(
+                max_len, [x['segments'] for x in batch], [x['labels'] for x in batch])
+            batch_dict['gt_cls_labels'] = gt_cls_labels
+            batch_dict['gt_offsets'] = gt_offsets
+
+        return batch_dict
+
+def load_columnar_db(npz_file):
+    """
+        Load a columnar annotation file (see convert-annotations.py)
+        Returns a dict video_id -> {'subset', 'duration', 'segments' (N x 2), 'labels' (N, )}
+        with the videos in their original order
+    """
+    with np.load(npz_file) as data:
+        data = {key: data[key] for key in data.files}
+    # annotations are grouped by video
+    _, first_rows, num_rows = np.unique(
+        data['video_id'], return_index=True, return_counts=True)
+    rows = dict(zip(data['video_id'][first_rows].tolist(),
+                    zip(first_rows.tolist(), num_rows.tolist())))
+    segments = np.stack((data['start'], data['stop']), axis=1).astype(np.float32)
+    labels = data['label'].astype(np.int64)
+
+    db = {}
+    for idx, video_id in enumerate(data['videos'].tolist()):
+        st, num = rows.get(video_id, (0, 0))
+        db[video_id] = {
+            'subset': str(data['subset'][idx]),
+            'duration': float(data['duration'][idx]),
+            'segments': segments[st:st + num],
+            'labels': labels[st:st + num],
+        }
+    return db
+
+def _encode_db(dict_db, label_dict):
+    # dict_db (a tuple of dicts) -> a few flat arrays
+    num_acts = [len(item['labels']) if item['labels'] is not None else -1
+                for item in dict_db]
+    segments = [item['segments'] for item in dict_db if item['segments'] is not None]
+    labels = [item['labels'] for item in dict_db if item['labels'] is not None]
+    # fps / duration / offset as json, so they are decoded with their types (int / float / None)
+    scalars = [[item['fps'], item['duration'], item.get('offset')] for item in dict_db]
+    return {
+        'ids': np.array([item['id'] for item in dict_db], dtype=str),
+        'scalars': np.array(json.dumps(scalars, default=lambda x: x.item())),
+        'num_acts': np.array(num_acts, dtype=np.int64),
+        'segments': np.concatenate(segments).astype(np.float32)
+            if len(segments) > 0 else np.zeros((0, 2), dtype=np.float32),
+        'labels': np.concatenate(labels).astype(np.int64)
+            if len(labels) > 0 else np.zeros((0, ), dtype=np.int64),
+        # only for datasets with an offset per video (ego4d)
+        'has_offset': np.array('offset' in dict_db[0] if len(dict_db) > 0 else False),
+        # labels / label ids may be strings or ints
+        'label_dict': np.array(json.dumps(list(label_dict.items()))),
+    }
+
+def _decode_db(data):
+    # inverse of _encode_db
+    dict_db = []
+    has_offset = bool(data['has_offset'])
+    scalars = json.loads(str(data['scalars']))
+    st = 0
+    for idx, video_id in enumerate(data['ids'].tolist()):
+        num_acts = int(data['num_acts'][idx])
+        if num_acts >= 0:
+            segments = data['segments'][st:st + num_acts]
+            labels = data['labels'][st:st + num_acts]
+            st += num_acts
+        else:
+            segments, labels = None, None
+        fps, duration, offset = scalars[idx]
+        item = {'id': video_id,
+                'fps': fps,
+                'duration': duration,
+                'segments': segments,
+                'labels': labels}
+        if has_offset:
+            item['offset'] = offset
+        dict_db.append(item)
+    label_dict = {k: v for k, v in json.loads(str(data['label_dict']))}
+    return tuple(dict_db), label_dict
+
+# version of the cached annotations (caches of other versions are not used)
+DB_CACHE_VERSION = 3
+
+def load_cached_db(json_file, cache_key, parse_fn):
+    """
+        Load (dict_db, label_dict) of a dataset from the annotation cache,
+        or build them with parse_fn(json_file) and cache them.
+        Cache files (.db_cache/ next to the json file) are keyed by the hash of
+        the json content and cache_key (e.g., dataset, split and fps)
+    """
+    file_hash = hashlib.sha1()
+    with open(json_file, 'rb') as fid:
+        for chunk in iter(lambda: fid.read(1 << 24), b''):
+            file_hash.update(chunk)
+    file_hash.update(repr((DB_CACHE_VERSION, cache_key)).encode())
+    cache_folder = os.path.join(os.path.dirname(json_file), '.db_cache')
+    cache_file = os.path.join(cache_folder, '{:s}.{:s}.npz'.format(
+        os.path.basename(json_file), file_hash.hexdigest()[:16]))
+
+    if os.path.isfile(cache_file):
+        with np.load(cache_file) as data:
+            return _decode_db(data)
+
+    dict_db, label_dict = parse_fn(json_file)
+    # the cache is optional (e.g., read-only annotation folders)
+    try:
+        os.makedirs(cache_folder, exist_ok=True)
+        tmp_file = cache_file[:-len('.npz')] + '.{:d}.tmp.npz'.format(os.getpid())
+        np.savez(tmp_file, **_encode_db(dict_db, label_dict))
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        pass
+    return dict_db, label_dict
+
+class BucketBatchSampler(torch.utils.data.Sampler):
+    """
+        A batch sampler that only batches videos of similar length
+        seq_lens: the length of each video (after truncation)
+        bucket_boundaries: sorted lengths splitting the buckets, e.g. [256, 512, 1024]
+        sample_weights: optional per video sampling weights (sampled with replacement)
+        Videos are shuffled within each bucket and the batches are shuffled across buckets
+    """
+    def __init__(
+        self,
+        seq_lens,
+        bucket_boundaries,
+        batch_size,
+        drop_last=True,
+        sample_weights=None,
+        generator=None
+    ):
+        self.batch_size = batch_size
+        self.drop_last = drop_last
+        self.generator = generator
+        self.sample_weights = None
+        if sample_weights is not None:
+            self.sample_weights = torch.as_tensor(sample_weights, dtype=torch.double)
+        # bucket index of each video
+        self.bucket_ids = [bisect.bisect_left(bucket_boundaries, l) for l in seq_lens]
+        self.num_buckets = len(bucket_boundaries) + 1
+        self.buckets = [[] for _ in range(self.num_buckets)]
+        for idx, bucket_id in enumerate(self.bucket_ids):
+            self.buckets[bucket_id].append(idx)
+
+    def __len__(self):
+        if self.sample_weights is not None:
+            # as many batches as an epoch without buckets
+            return len(self.bucket_ids) // self.batch_size
+        if self.drop_last:
+            return sum(len(b) // self.batch_size for b in self.buckets)
+        return sum((len(b) + self.batch_size - 1) // self.batch_size for b in self.buckets)
+
+    def _weighted_batches(self):
+        # draw videos until enough batches are filled, buckets are filled independently
+        buckets = [[] for _ in range(self.num_buckets)]
+        batches = []
+        while len(batches) < len(self):
+            draws = torch.multinomial(
+                self.sample_weights, len(self.bucket_ids),
+                replacement=True, generator=self.generator
+            ).tolist()
+            for idx in draws:
+                bucket = buckets[self.bucket_ids[idx]]
+                bucket.append(idx)
+                if len(bucket) == self.batch_size:
+                    batches.append(bucket[:])
+                    bucket.clear()
+                    if len(batches) == len(self):
+                        break
+        return batches
+
+    def __iter__(self):
+        if self.sample_weights is not None:
+            batches = self._weighted_batches()
+        else:
+            batches = []
+            for bucket in self.buckets:
+                order = torch.randperm(len(bucket), generator=self.generator).tolist()
+                bucket = [bucket[i] for i in order]
+                for st in range(0, len(bucket), self.batch_size):
+                    batch = bucket[st:st + self.batch_size]
+                    if len(batch) == self.batch_size or not self.drop_last:
+                        batches.append(batch)
+        # mix the buckets
+        order = torch.randperm(len(batches), generator=self.generator).tolist()
+        for i in order:
+            yield batches[i]
+
 def worker_init_reset_seed(worker_id):
     """
         Reset random seed for each worker
@@ -21,37 +275,144 @@ def worker_init_reset_seed(worker_id):
     random.seed(seed)
     os.environ["PYTHONHASHSEED"] = str(seed)
 
-def truncate_feats(
-    data_dict,
+def _count_ranges(lo, hi, size):
+    # number of integer ranges [lo, hi] covering each of 0 .. size - 1 (difference array)
+    lo = np.clip(lo, 0, size)
+    hi = np.clip(hi + 1, 0, size)
+    keep = lo < hi
+    diff = np.zeros(size + 1, dtype=np.int64)
+    np.add.at(diff, lo[keep], 1)
+    np.add.at(diff, hi[keep], -1)
+    return np.cumsum(diff[:-1])
+
+def get_valid_trunc_windows(
+    feat_len,
+    segments,
     max_seq_len,
     trunc_thresh,
     offset,
-    crop_ratio=None,
-    max_num_trials=200,
-    has_action=True,
     no_trunc=False
 ):
     """
-    Truncate feats and time stamps in a dict item
+    All the valid truncation windows [st, st + max_seq_len) of a video, i.e.,
+    with at least one action over trunc_thresh (and, if no_trunc, without any
+    partially truncated action), computed by interval arithmetic on the segments
+    (N x 2 in feature grid) instead of trying random windows.
 
-    data_dict = {'video_id'        : str
-                 'feats'           : Tensor C x T
-                 'segments'        : Tensor N x 2 (in feature grid)
-                 'labels'          : Tensor N
-                 'fps'             : float
-                 'feat_stride'     : int
-                 'feat_num_frames' : in
+    For a segment [s0, s1] of length L, the window intersects at least r = thresh * L
+    iff st is in [s0 + r - max_seq_len - offset, s1 + offset - r].
+    Returns (starts, cum_sizes): the valid st are the disjoint integer ranges
+    starts[i] ... starts[i] + (cum_sizes[i] - cum_sizes[i - 1]) - 1
+    """
+    num_starts = feat_len - max_seq_len + 1
+    segments = np.asarray(segments, dtype=np.float64).reshape(-1, 2)
+    # empty segments never count (their intersection ratio is nan or 0)
+    seg_lens = segments[:, 1] - segments[:, 0]
+    segments, seg_lens = segments[seg_lens > 0], seg_lens[seg_lens > 0]
+    s0, s1 = segments[:, 0], segments[:, 1]
+
+    # starts with at least one action over the thresh
+    r = trunc_thresh * seg_lens
+    if trunc_thresh > 0:
+        lo = np.ceil(s0 + r - max_seq_len - offset)
+        hi = np.floor(s1 + offset - r)
+        # the window (+ offset) must also be long enough to cover r
+        hi[(max_seq_len + 2 * offset < r) | (seg_lens < r)] = -1
+    else:
+        lo = np.zeros(len(segments))
+        hi = np.full(len(segments), num_starts - 1)
+    valid = _count_ranges(lo.astype(np.int64), hi.astype(np.int64), num_starts) > 0
 
+    if no_trunc:
+        # starts that intersect a segment (> 0) without covering it (< L)
+        inter_lo = np.floor(s0 - max_seq_len - offset) + 1
+        inter_hi = np.ceil(s1 + offset) - 1
+        full_lo = np.ceil(s1 - max_seq_len - offset)
+        full_hi = np.floor(s0 + offset)
+        num_trunc = (
+            _count_ranges(inter_lo.astype(np.int64), inter_hi.astype(np.int64), num_starts)
+            - _count_ranges(full_lo.astype(np.int64), full_hi.astype(np.int64), num_starts)
+        )
+        valid &= (num_trunc == 0)
+
+    # mask -> disjoint ranges
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], valid.astype(np.int8), [0]))))
+    starts, ends = edges[0::2], edges[1::2]
+    return starts, np.cumsum(ends - starts)
+
+def get_num_feats(data_list, feat_store):
     """
-    # get the meta info
-    feat_len = data_dict['feats'].shape[1]
-    num_segs = data_dict['segments'].shape[0]
+    Number of feats of each video of data_list, keyed by video id, from the
+    store metadata (no feats are read). Built once by the datasets and reused
+    for the truncation windows, the bucketing and __getitem__.
+    """
+    return {video_item['id']: feat_store.get_num_feats(video_item['id'])
+            for video_item in data_list}
 
+def get_trunc_windows(
+    data_list,
+    num_feats,
+    feat_stride,
+    num_frames,
+    downsample_rate,
+    max_seq_len,
+    trunc_thresh
+):
+    """
+    Valid truncation windows (see get_valid_trunc_windows) of each video of
+    data_list longer than max_seq_len, keyed by video id. The segments are
+    mapped to the same feature grid as in the __getitem__ of the datasets.
+    num_feats: number of feats of each video (see get_num_feats)
+    """
+    feat_stride = feat_stride * downsample_rate
+    feat_offset = 0.5 * num_frames / feat_stride
+    trunc_windows = {}
+    for video_item in data_list:
+        if video_item['segments'] is None:
+            continue
+        feat_len = len(range(0, num_feats[video_item['id']], downsample_rate))
+        if feat_len > max_seq_len:
+            segments = video_item['segments'] * video_item['fps'] / feat_stride - feat_offset
+            trunc_windows[video_item['id']] = get_valid_trunc_windows(
+                feat_len, segments, max_seq_len, trunc_thresh, feat_offset)
+    return trunc_windows
+
+def get_seq_lens(data_list, num_feats, downsample_rate, max_seq_len):
+    """
+    Length of each video of data_list after downsampling / truncation (used to
+    bucket batches), from the number of feats of each video (see get_num_feats)
+    """
+    seq_lens = []
+    for video_item in data_list:
+        feat_len = len(range(0, num_feats[video_item['id']], downsample_rate))
+        seq_lens.append(min(feat_len, max_seq_len))
+    return seq_lens
+
+def sample_trunc_window(
+    feat_len,
+    segments,
+    max_seq_len,
+    trunc_thresh,
+    offset,
+    crop_ratio=None,
+    has_action=True,
+    no_trunc=False,
+    valid_windows=None
+):
+    """
+    Sample a truncation window [st, ed) for a video of feat_len features
+
+    Only needs the length of the feats and the segments (N x 2 in feature grid),
+    so the window can be chosen before the features are read from disk.
+    valid_windows: optional output of get_valid_trunc_windows for max_seq_len
+    (e.g., precomputed by the dataset), computed here otherwise.
+    Returns None if no truncation is needed.
+    """
     # seq_len < max_seq_len
     if feat_len <= max_seq_len:
         # do nothing
         if crop_ratio == None:
-            return data_dict
+            return None
         # randomly crop the seq by setting max_seq_len to a value in [l, r]
         else:
             max_seq_len = random.randint(
@@ -60,53 +421,103 @@ def truncate_feats(
             )
             # # corner case
             if feat_len == max_seq_len:
-                return data_dict
-
-    # otherwise, deep copy the dict
-    data_dict = copy.deepcopy(data_dict)
-
-    # try a few times till a valid truncation with at least one action
-    for _ in range(max_num_trials):
-
-        # sample a random truncation of the video feats
-        st = random.randint(0, feat_len - max_seq_len)
-        ed = st + max_seq_len
-        window = torch.as_tensor([st, ed], dtype=torch.float32)
-
-        # compute the intersection between the sampled window and all segments
-        window = window[None].repeat(num_segs, 1)
-        left = torch.maximum(window[:, 0] - offset, data_dict['segments'][:, 0])
-        right = torch.minimum(window[:, 1] + offset, data_dict['segments'][:, 1])
-        inter = (right - left).clamp(min=0)
-        area_segs = torch.abs(
-            data_dict['segments'][:, 1] - data_dict['segments'][:, 0])
-        inter_ratio = inter / area_segs
-
-        # only select those segments over the thresh
-        seg_idx = (inter_ratio >= trunc_thresh)
-
-        if no_trunc:
-            # with at least one action and not truncating any actions
-            seg_trunc_idx = torch.logical_and(
-                (inter_ratio > 0.0), (inter_ratio < 1.0)
+                return None
+            # the precomputed windows are for the original max_seq_len
+            valid_windows = None
+
+    # a uniform draw among the valid windows
+    if has_action or no_trunc:
+        if valid_windows is None:
+            valid_windows = get_valid_trunc_windows(
+                feat_len, segments, max_seq_len, trunc_thresh, offset, no_trunc=no_trunc
             )
-            if (seg_idx.sum().item() > 0) and (seg_trunc_idx.sum().item() == 0):
-                break
-        elif has_action:
-            # with at least one action
-            if seg_idx.sum().item() > 0:
-                break
-        else:
-            # without any constraints
-            break
-
-    # feats: C x T
-    data_dict['feats'] = data_dict['feats'][:, st:ed].clone()
-    # segments: N x 2 in feature grids
-    data_dict['segments'] = torch.stack((left[seg_idx], right[seg_idx]), dim=1)
-    # shift the time stamps due to truncation
-    data_dict['segments'] = data_dict['segments'] - st
-    # labels: N
-    data_dict['labels'] = data_dict['labels'][seg_idx].clone()
+        starts, cum_sizes = valid_windows
+        if len(cum_sizes) > 0:
+            idx = random.randrange(int(cum_sizes[-1]))
+            range_idx = int(np.searchsorted(cum_sizes, idx, side='right'))
+            prev_size = int(cum_sizes[range_idx - 1]) if range_idx > 0 else 0
+            st = int(starts[range_idx]) + idx - prev_size
+            return st, st + max_seq_len
+
+    # without any constraints (or no valid window)
+    st = random.randint(0, feat_len - max_seq_len)
+    return st, st + max_seq_len
+
+def _window_intersection(segments, st, ed, offset):
+    # intersection between the window [st, ed] and all segments N x 2
+    num_segs = segments.shape[0]
+    window = torch.as_tensor([st, ed], dtype=torch.float32)
+    window = window[None].repeat(num_segs, 1)
+    left = torch.maximum(window[:, 0] - offset, segments[:, 0])
+    right = torch.minimum(window[:, 1] + offset, segments[:, 1])
+    inter = (right - left).clamp(min=0)
+    area_segs = torch.abs(segments[:, 1] - segments[:, 0])
+    inter_ratio = inter / area_segs
+    return left, right, inter_ratio
+
+def apply_trunc_window(
+    data_dict,
+    window,
+    trunc_thresh,
+    offset,
+    feats_truncated=False
+):
+    """
+    Truncate feats and time stamps in a dict item to the window [st, ed)
+    If feats_truncated is True, data_dict['feats'] only holds the window already
+    (e.g., it was read from a sliceable feature store) and is left untouched.
+
+    Returns a new dict, data_dict itself is not modified. The other fields are
+    shared with data_dict, only the window of the feats is copied (once).
+    """
+    st, ed = window
+    left, right, inter_ratio = _window_intersection(
+        data_dict['segments'], st, ed, offset)
+    seg_idx = (inter_ratio >= trunc_thresh)
+
+    data_dict = dict(data_dict)
+    # feats: C x T (a copy, so the full feats are not kept alive / sent to the main process)
+    if not feats_truncated:
+        data_dict['feats'] = data_dict['feats'][:, st:ed].clone()
+    # segments: N x 2 in feature grids, shifted due to truncation
+    data_dict['segments'] = torch.stack((left[seg_idx] - st, right[seg_idx] - st), dim=1)
+    # labels: N (boolean indexing already returns a new tensor)
+    data_dict['labels'] = data_dict['labels'][seg_idx]
 
     return data_dict
+
+def truncate_feats(
+    data_dict,
+    max_seq_len,
+    trunc_thresh,
+    offset,
+    crop_ratio=None,
+    has_action=True,
+    no_trunc=False
+):
+    """
+    Truncate feats and time stamps in a dict item
+    (the window is drawn from all the valid windows, see sample_trunc_window)
+
+    data_dict = {'video_id'        : str
+                 'feats'           : Tensor C x T
+                 'segments'        : Tensor N x 2 (in feature grid)
+                 'labels'          : Tensor N
+                 'fps'             : float
+                 'feat_stride'     : int
+                 'feat_num_frames' : in
+
+    """
+    # get the meta info
+    feat_len = data_dict['feats'].shape[1]
+
+    # sample the window, None if there is nothing to truncate
+    window = sample_trunc_window(
+        feat_len, data_dict['segments'], max_seq_len, trunc_thresh, offset,
+        crop_ratio=crop_ratio, has_action=has_action, no_trunc=no_trunc
+    )
+    if window is None:
+        return data_dict
+
+    # a new dict with a single copy of the window (data_dict is left untouched)
+    return apply_trunc_window(data_dict, window, trunc_thresh, offset)
@@ -1,6 +1,7 @@
 import os
 import torch
-from .data_utils import trivial_batch_collator, worker_init_reset_seed
+from .data_utils import (trivial_batch_collator, worker_init_reset_seed, BucketBatchSampler,
+                         PaddedBatchCollator)
 
 datasets = {}
 def register_dataset(name):
@@ -16,17 +17,72 @@ def make_dataset(name, is_training, split, **kwargs):
    dataset = datasets[name](is_training, split, **kwargs)
    return dataset
 
-def make_data_loader(dataset, is_training, generator, batch_size, num_workers):
+def make_data_loader(dataset, is_training, generator, batch_size, num_workers,
+                     bucket_boundaries=None, pad_in_workers=False, targets_in_workers=False,
+                     batch_padding=None, target_assigner=None):
     """
         A simple dataloder builder
+        bucket_boundaries: if set, training batches only group videos of
+        similar length (see BucketBatchSampler)
+        pad_in_workers: if set, batches are padded / masked by the workers
+        (see PaddedBatchCollator) and pinned, batch_padding is the padding of
+        the model (PtTransformer.get_batch_padding)
+        targets_in_workers: if set (with pad_in_workers), the targets of the
+        training batches are also assigned by the workers, using target_assigner
+        (PtTransformer.get_target_assigner)
     """
+    collate_fn = trivial_batch_collator
+    if pad_in_workers:
+        assert batch_padding is not None, "Padding in the workers needs the padding of the model"
+        if is_training and targets_in_workers:
+            assert target_assigner is not None, "Targets in the workers need the target assigner of the model"
+        else:
+            target_assigner = None
+        collate_fn = PaddedBatchCollator(is_training, target_assigner=target_assigner, **batch_padding)
+    else:
+        assert not targets_in_workers, "Targets can only be assigned in the workers with pad_in_workers"
+    pin_memory = pad_in_workers and torch.cuda.is_available()
+
+    # datasets with per-sample weights (e.g., union with source weights) are sampled
+    # with replacement: an epoch is len(dataset) draws, not one pass over the videos
+    sample_weights = None
+    if is_training and hasattr(dataset, 'get_sample_weights'):
+        sample_weights = dataset.get_sample_weights()
+
+    if is_training and bucket_boundaries:
+        assert hasattr(dataset, 'get_seq_lens'), \
+            "Dataset does not support length bucketing"
+        batch_sampler = BucketBatchSampler(
+            dataset.get_seq_lens(), sorted(bucket_boundaries), batch_size,
+            drop_last=True, sample_weights=sample_weights, generator=generator
+        )
+        loader = torch.utils.data.DataLoader(
+            dataset,
+            batch_sampler=batch_sampler,
+            num_workers=num_workers,
+            collate_fn=collate_fn,
+            pin_memory=pin_memory,
+            worker_init_fn=worker_init_reset_seed,
+            generator=generator,
+            persistent_workers=True
+        )
+        return loader
+
+    sampler = None
+    if sample_weights is not None:
+        sampler = torch.utils.data.WeightedRandomSampler(
+            sample_weights, len(dataset),
+            replacement=True, generator=generator
+        )
     loader = torch.utils.data.DataLoader(
         dataset,
         batch_size=batch_size,
         num_workers=num_workers,
-        collate_fn=trivial_batch_collator,
+        collate_fn=collate_fn,
+        pin_memory=pin_memory,
         worker_init_fn=(worker_init_reset_seed if is_training else None),
-        shuffle=is_training,
+        shuffle=(is_training and sampler is None),
+        sampler=sampler,
         drop_last=is_training,
         generator=generator,
         persistent_workers=True
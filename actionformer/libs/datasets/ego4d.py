@@ -7,7 +7,10 @@ from torch.utils.data import Dataset
 from torch.nn import functional as F
 
 from .datasets import register_dataset
-from .data_utils import truncate_feats
+from .data_utils import (sample_trunc_window, apply_trunc_window, get_trunc_windows, get_seq_lens,
+                          get_num_feats, load_cached_db)
+from .feat_stores import make_feat_store
+from .feat_cache import FeatCache
 
 @register_dataset("ego4d")
 class EGO4DDataset(Dataset):
@@ -28,7 +31,10 @@ class EGO4DDataset(Dataset):
         num_classes,     # number of action categories
         file_prefix,     # feature file prefix if any
         file_ext,        # feature file extension if any
-        force_upsampling # force to upsample to max_seq_len
+        force_upsampling, # force to upsample to max_seq_len
+        feat_backend='npy', # storage format of the feats (npy | npz | mmap | pack)
+        feat_cache_gb=0,   # size of the shared feature cache in GB (of all the folders), 0 to disable
+        feat_cache=None    # a FeatCache shared with other datasets (overrides feat_cache_gb)
     ):
         # file path
         if not isinstance(feat_folder, (list, tuple)):
@@ -44,6 +50,13 @@ class EGO4DDataset(Dataset):
             self.file_prefix = ''
         self.file_ext = file_ext
         self.json_file = json_file
+        # one store per feature folder, concatenated along the channels
+        # (all the folders share the same feature cache)
+        if feat_cache is None and feat_cache_gb > 0:
+            feat_cache = FeatCache(feat_cache_gb)
+        self.feat_stores = [make_feat_store(
+            feat_backend, folder, self.file_prefix, file_ext, feat_cache=feat_cache
+        ) for folder in feat_folder]
 
         # split / training mode
         self.split = split
@@ -66,6 +79,10 @@ class EGO4DDataset(Dataset):
         assert len(label_dict) == num_classes
         self.data_list = dict_db
         self.label_dict = label_dict
+        # number of feats of each video (store metadata is only read once)
+        self.num_feats = get_num_feats(self.data_list, self.feat_stores[0])
+        # valid truncation windows of the long videos (built once, sampled directly)
+        self.trunc_windows = self._get_trunc_windows() if is_training else {}
 
         # dataset specific attributes
         self.db_attributes = {
@@ -78,6 +95,15 @@ class EGO4DDataset(Dataset):
         return self.db_attributes
 
     def _load_json_db(self, json_file):
+        # parsed once, then loaded from the annotation cache
+        dict_db, label_dict = load_cached_db(
+            json_file, ('ego4d', tuple(sorted(self.split)), self.default_fps), self._parse_json_db)
+        # skip the videos that do not have the feature files
+        dict_db = tuple(item for item in dict_db
+                        if all([store.has_video(item['id']) for store in self.feat_stores]))
+        return dict_db, label_dict
+
+    def _parse_json_db(self, json_file):
         # load database and select the subset
         with open(json_file, 'r') as fid:
             json_data = json.load(fid)
@@ -93,17 +119,11 @@ class EGO4DDataset(Dataset):
                     label_dict[act['label']] = act['label_id']
 
         # fill in the db (immutable afterwards)
-        dict_db = tuple()
+        dict_db = []
         for key, value in json_db.items():
             # skip the video if not in the split
             if value['subset'].lower() not in self.split:
                 continue
-            # or does not have the feature file
-            feat_files = [os.path.join(
-                folder, self.file_prefix + key + self.file_ext
-            ) for folder in self.feat_folder]
-            if not all([os.path.exists(file) for file in feat_files]):
-                continue
 
             # get fps if available
             if self.default_fps is not None:
@@ -132,15 +152,25 @@ class EGO4DDataset(Dataset):
                 segments = None
                 labels = None
 
-            dict_db += ({'id': key,
-                         'fps' : fps,
-                         'duration' : duration,
-                         'segments' : segments,
-                         'labels' : labels,
-                         'offset': value.get('offset'), # only for test
-            }, )
+            dict_db.append({'id': key,
+                            'fps' : fps,
+                            'duration' : duration,
+                            'segments' : segments,
+                            'labels' : labels,
+                            'offset': value.get('offset'), # only for test
+            })
 
-        return dict_db, label_dict
+        return tuple(dict_db), label_dict
+
+    def _get_trunc_windows(self):
+        # valid truncation windows of each video longer than max_seq_len
+        return get_trunc_windows(
+            self.data_list, self.num_feats, self.feat_stride, self.num_frames,
+            self.downsample_rate, self.max_seq_len, self.trunc_thresh)
+
+    def get_seq_lens(self):
+        # length of each video after downsampling / truncation (used to bucket batches)
+        return get_seq_lens(self.data_list, self.num_feats, self.downsample_rate, self.max_seq_len)
 
     def __len__(self):
         return len(self.data_list)
@@ -151,20 +181,13 @@ class EGO4DDataset(Dataset):
         # instead the model will need to decide how to batch / preporcess the data
         video_item = self.data_list[idx]
 
-        # load features
-        filenames = [os.path.join(
-            folder, self.file_prefix + video_item['id'] + self.file_ext
-        ) for folder in self.feat_folder]
-        feats = np.concatenate(
-            [np.load(name).astype(np.float32) for name in filenames], axis=1
-        )
+        # number of feats (built with the dataset, nothing is read yet)
+        num_feats = self.num_feats[video_item['id']]
 
         # deal with downsampling (= increased feat stride)
-        feats = feats[::self.downsample_rate, :]
+        feat_len = len(range(0, num_feats, self.downsample_rate))
         feat_stride = self.feat_stride * self.downsample_rate
         feat_offset = 0.5 * self.num_frames / feat_stride
-        # T x C -> C x T
-        feats = torch.from_numpy(np.ascontiguousarray(feats.transpose()))
 
         # convert time stamp (in second) into temporal feature grids
         # ok to have small negative values here
@@ -176,6 +199,24 @@ class EGO4DDataset(Dataset):
         else:
             segments, labels = None, None
 
+        # pick the truncation window during training before reading the feats
+        window = None
+        if self.is_training and (segments is not None):
+            window = sample_trunc_window(
+                feat_len, segments, self.max_seq_len, self.trunc_thresh, feat_offset, self.crop_ratio,
+                valid_windows=self.trunc_windows.get(video_item['id'])
+            )
+        st, ed = window if window is not None else (0, feat_len)
+
+        # only read the rows we keep (T x C, the feats of all folders are concatenated)
+        feats = np.concatenate(
+            [store.read_window(video_item['id'], st * self.downsample_rate,
+                               ed * self.downsample_rate, self.downsample_rate)
+             for store in self.feat_stores], axis=1
+        )
+        # T x C -> C x T
+        feats = torch.from_numpy(np.ascontiguousarray(feats.transpose()))
+
         # return a data dict
         data_dict = {'video_id'        : video_item['id'],
                      'feats'           : feats,      # C x T
@@ -188,10 +229,10 @@ class EGO4DDataset(Dataset):
                      'offset'          : video_item['offset'],
         }
 
-        # truncate the features during training
-        if self.is_training and (segments is not None):
-            data_dict = truncate_feats(
-                data_dict, self.max_seq_len, self.trunc_thresh, feat_offset, self.crop_ratio
+        # truncate the time stamps during training
+        if window is not None:
+            data_dict = apply_trunc_window(
+                data_dict, window, self.trunc_thresh, feat_offset, feats_truncated=True
             )
 
         return data_dict
\ No newline at end of file
@@ -7,7 +7,9 @@ from torch.utils.data import Dataset
 from torch.nn import functional as F
 
 from .datasets import register_dataset
-from .data_utils import truncate_feats
+from .data_utils import (sample_trunc_window, apply_trunc_window, get_trunc_windows, get_seq_lens,
+                          get_num_feats, load_columnar_db, load_cached_db)
+from .feat_stores import make_feat_store
 
 @register_dataset("epic")
 class EpicKitchensDataset(Dataset):
@@ -28,7 +30,11 @@ class EpicKitchensDataset(Dataset):
         num_classes,     # number of action categories
         file_prefix,     # feature file prefix if any
         file_ext,        # feature file extension if any
-        force_upsampling # force to upsample to max_seq_len
+        force_upsampling, # force to upsample to max_seq_len
+        feat_backend='npz', # storage format of the feats (npz | npy | mmap | clips | pack)
+        feat_dtype='float32', # dtype of the returned feats (float32 | float16)
+        feat_cache_gb=0,     # size of the shared feature cache in GB, 0 to disable
+        feat_cache=None      # a FeatCache shared with other datasets (overrides feat_cache_gb)
     ):
         # file path
         assert os.path.exists(feat_folder) and os.path.exists(json_file)
@@ -41,6 +47,11 @@ class EpicKitchensDataset(Dataset):
             self.file_prefix = ''
         self.file_ext = file_ext
         self.json_file = json_file
+        self.feat_store = make_feat_store(
+            feat_backend, feat_folder, self.file_prefix, file_ext, feat_cache_gb, feat_cache)
+        # float16 feats are handed to the model as they are (cast on device)
+        assert feat_dtype in ['float32', 'float16']
+        self.feat_dtype = np.dtype(feat_dtype)
 
         # split / training mode
         self.split = split
@@ -64,6 +75,10 @@ class EpicKitchensDataset(Dataset):
         assert len(label_dict) <= num_classes
         self.data_list = dict_db
         self.label_dict = label_dict
+        # number of feats of each video (store metadata is only read once)
+        self.num_feats = get_num_feats(self.data_list, self.feat_store)
+        # valid truncation windows of the long videos (built once, sampled directly)
+        self.trunc_windows = self._get_trunc_windows() if is_training else {}
 
         # dataset specific attributes
         empty_label_ids = self.find_empty_cls(label_dict, num_classes)
@@ -88,20 +103,29 @@ class EpicKitchensDataset(Dataset):
         return self.db_attributes
 
     def _load_json_db(self, json_file):
+        # columnar annotations (see convert-annotations.py)
+        if json_file.endswith('.npz'):
+            return self._load_columnar_db(json_file)
+        # parsed once, then loaded from the annotation cache
+        return load_cached_db(
+            json_file, ('epic', tuple(sorted(self.split)), self.default_fps), self._parse_json_db)
+
+    def _parse_json_db(self, json_file):
         # load database and select the subset
         with open(json_file, 'r') as fid:
             json_data = json.load(fid)
         json_db = json_data['database']
 
         # if label_dict is not available
+        # (label name -> int label id, convert-annotations.py writes the label ids as strings)
         if self.label_dict is None:
             label_dict = {}
             for key, value in json_db.items():
                 for act in value['annotations']:
-                    label_dict[act['label']] = act['label_id']
+                    label_dict[act['label']] = int(act['label_id'])
 
         # fill in the db (immutable afterwards)
-        dict_db = tuple()
+        dict_db = []
         for key, value in json_db.items():
             # skip the video if not in the split
             if value['subset'].lower() not in self.split:
@@ -133,14 +157,56 @@ class EpicKitchensDataset(Dataset):
             else:
                 segments = None
                 labels = None
-            dict_db += ({'id': key,
-                         'fps' : fps,
-                         'duration' : duration,
-                         'segments' : segments,
-                         'labels' : labels
-            }, )
+            dict_db.append({'id': key,
+                            'fps' : fps,
+                            'duration' : duration,
+                            'segments' : segments,
+                            'labels' : labels
+            })
+
+        return tuple(dict_db), label_dict
+
+    def _load_columnar_db(self, npz_file):
+        # same as _parse_json_db, without parsing any json
+        columnar_db = load_columnar_db(npz_file)
+        # labels are already label ids, their names (as in the json file) are the ids as strings
+        label_dict = {}
+        for value in columnar_db.values():
+            for label in value['labels'].tolist():
+                label_dict[str(label)] = label
+
+        dict_db = []
+        for key, value in columnar_db.items():
+            # skip the video if not in the split
+            if value['subset'].lower() not in self.split:
+                continue
+            # get fps if available
+            if self.default_fps is not None:
+                fps = self.default_fps
+            else:
+                assert False, "Unknown video FPS."
+            if len(value['labels']) > 0:
+                segments, labels = value['segments'], value['labels']
+            else:
+                segments, labels = None, None
+            dict_db.append({'id': key,
+                            'fps' : fps,
+                            'duration' : value['duration'],
+                            'segments' : segments,
+                            'labels' : labels
+            })
+
+        return tuple(dict_db), label_dict
 
-        return dict_db, label_dict
+    def _get_trunc_windows(self):
+        # valid truncation windows of each video longer than max_seq_len
+        return get_trunc_windows(
+            self.data_list, self.num_feats, self.feat_stride, self.num_frames,
+            self.downsample_rate, self.max_seq_len, self.trunc_thresh)
+
+    def get_seq_lens(self):
+        # length of each video after downsampling / truncation (used to bucket batches)
+        return get_seq_lens(self.data_list, self.num_feats, self.downsample_rate, self.max_seq_len)
 
     def __len__(self):
         return len(self.data_list)
@@ -151,19 +217,13 @@ class EpicKitchensDataset(Dataset):
         # instead the model will need to decide how to batch / preporcess the data
         video_item = self.data_list[idx]
 
-        # load features
-        filename = os.path.join(self.feat_folder,
-                                self.file_prefix + video_item['id'] + self.file_ext)
-        # print('Cargando', filename, '...')
-        with np.load(filename) as data:
-            feats = data['feats'].astype(np.float32)
+        # number of feats (built with the dataset, nothing is read yet)
+        num_feats = self.num_feats[video_item['id']]
 
         # deal with downsampling (= increased feat stride)
-        feats = feats[::self.downsample_rate, :]
+        feat_len = len(range(0, num_feats, self.downsample_rate))
         feat_stride = self.feat_stride * self.downsample_rate
         feat_offset = 0.5 * self.num_frames / feat_stride
-        # T x C -> C x T
-        feats = torch.from_numpy(np.ascontiguousarray(feats.transpose()))
 
         # convert time stamp (in second) into temporal feature grids
         # ok to have small negative values here
@@ -175,6 +235,22 @@ class EpicKitchensDataset(Dataset):
         else:
             segments, labels = None, None
 
+        # pick the truncation window during training before reading the feats
+        window = None
+        if self.is_training and (segments is not None):
+            window = sample_trunc_window(
+                feat_len, segments, self.max_seq_len, self.trunc_thresh, feat_offset, self.crop_ratio,
+                valid_windows=self.trunc_windows.get(video_item['id'])
+            )
+        st, ed = window if window is not None else (0, feat_len)
+
+        # only read the rows we keep
+        feats = self.feat_store.read_window(
+            video_item['id'], st * self.downsample_rate, ed * self.downsample_rate, self.downsample_rate,
+            dtype=self.feat_dtype)
+        # T x C -> C x T
+        feats = torch.from_numpy(np.array(feats.transpose(), order='C'))
+
         # return a data dict
         data_dict = {'video_id'        : video_item['id'],
                      'feats'           : feats,      # C x T
@@ -185,10 +261,10 @@ class EpicKitchensDataset(Dataset):
                      'feat_stride'     : feat_stride,
                      'feat_num_frames' : self.num_frames}
 
-        # truncate the features during training
-        if self.is_training and (segments is not None):
-            data_dict = truncate_feats(
-                data_dict, self.max_seq_len, self.trunc_thresh, feat_offset, self.crop_ratio
+        # truncate the time stamps during training
+        if window is not None:
+            data_dict = apply_trunc_window(
+                data_dict, window, self.trunc_thresh, feat_offset, feats_truncated=True
             )
 
         return data_dict
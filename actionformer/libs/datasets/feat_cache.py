@@ -0,0 +1,207 @@
+import atexit
+import hashlib
+import os
+import multiprocessing as mp
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+
+def _untrack(shm):
+    # blocks are shared by all workers and freed by the cache (not at worker exit)
+    try:
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception:
+        pass
+
+def _unlink(name):
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    # unlink() also unregisters the block from the resource tracker
+    shm.close()
+    shm.unlink()
+
+
+class FeatCache(object):
+    """
+        A LRU cache of decoded feats (one shared memory block per video)
+        shared by the main process and all the data loader workers.
+        The index (video -> block, last use), the counters and the lock live in a
+        manager process, the feats themselves are never pickled.
+        budget_gb: max size of all the cached feats
+    """
+    def __init__(self, budget_gb):
+        self.budget = int(budget_gb * (1024 ** 3))
+        self.manager = mp.Manager()
+        self.index = self.manager.dict()
+        self.stats = self.manager.dict({'hits': 0, 'misses': 0, 'bytes': 0, 'tick': 0})
+        self.lock = self.manager.Lock()
+        # unique prefix of the block names
+        self.prefix = 'featcache_' + hashlib.sha1(
+            repr((id(self), mp.current_process().pid)).encode()).hexdigest()[:12]
+        atexit.register(self.close)
+
+    def __getstate__(self):
+        # only the proxies are sent to the workers
+        state = self.__dict__.copy()
+        state['manager'] = None
+        return state
+
+    def _block_name(self, key):
+        return self.prefix + '_' + hashlib.sha1(key.encode()).hexdigest()[:16]
+
+    def _touch(self, key):
+        # update the counters and the last use of a video (with the lock held)
+        self.stats['tick'] += 1
+        entry = self.index[key]
+        self.index[key] = entry[:3] + (self.stats['tick'], )
+
+    def get(self, key):
+        """return a CachedFeatArray, or None on a miss"""
+        with self.lock:
+            if key not in self.index:
+                self.stats['misses'] += 1
+                return None
+            self.stats['hits'] += 1
+            self._touch(key)
+            name, shape, dtype, _ = self.index[key]
+        try:
+            shm = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            # evicted in the meantime
+            return None
+        _untrack(shm)
+        return CachedFeatArray(shm, shape, dtype)
+
+    def get_shape(self, key):
+        """shape of the cached feats of a video (not counted as a use), or None"""
+        entry = self.index.get(key)
+        return None if entry is None else tuple(entry[1])
+
+    def put(self, key, feats):
+        """copy the feats (a numpy array) into the cache, evicting old videos if needed"""
+        feats = np.ascontiguousarray(feats)
+        if feats.nbytes == 0 or feats.nbytes > self.budget:
+            return
+        name = self._block_name(key)
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=feats.nbytes)
+        except FileExistsError:
+            # being added by another worker
+            return
+        _untrack(shm)
+        np.ndarray(feats.shape, dtype=feats.dtype, buffer=shm.buf)[:] = feats
+        shm.close()
+
+        with self.lock:
+            if key in self.index:
+                _unlink(name)
+                return
+            # evict the least recently used videos
+            while self.stats['bytes'] + feats.nbytes > self.budget and len(self.index) > 0:
+                items = self.index.items()
+                old_key, (old_name, old_shape, old_dtype, _) = min(items, key=lambda x: x[1][3])
+                del self.index[old_key]
+                self.stats['bytes'] -= int(np.prod(old_shape)) * np.dtype(old_dtype).itemsize
+                _unlink(old_name)
+            self.stats['tick'] += 1
+            self.index[key] = (name, feats.shape, feats.dtype.str, self.stats['tick'])
+            self.stats['bytes'] += feats.nbytes
+
+    def get_stats(self):
+        """hits / misses since the cache was created, and its current size"""
+        stats = dict(self.stats)
+        return {'hits': stats['hits'], 'misses': stats['misses'],
+                'num_videos': len(self.index), 'size_gb': stats['bytes'] / (1024 ** 3)}
+
+    def close(self):
+        """free all the blocks (only from the process that created the cache)"""
+        if self.manager is None:
+            return
+        try:
+            for name, _, _, _ in self.index.values():
+                _unlink(name)
+            self.manager.shutdown()
+        except Exception:
+            pass
+        self.manager = None
+
+
+class CachedFeatArray(object):
+    """
+        A T x C array over a block of the feature cache
+        Indexing returns a copy, so the block can be released right after
+    """
+    def __init__(self, shm, shape, dtype):
+        self.shm = shm
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        feats = np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)
+        out = np.array(feats[key])
+        del feats
+        return out
+
+    def __array__(self, dtype=None, copy=None):
+        feats = self[:]
+        return feats if dtype is None else feats.astype(dtype)
+
+    def __del__(self):
+        self.shm.close()
+
+
+class CachedFeatStore(object):
+    """
+        Wraps a feature store, the decoded feats of each video are kept in a
+        FeatCache shared by all the data loader workers
+        A cache can be shared by several stores (e.g., all the sources of a
+        dataset), videos are keyed by the folder and file name of their feats
+    """
+    def __init__(self, feat_store, cache):
+        self.feat_store = feat_store
+        self.cache = cache
+        self.key_prefix = os.path.join(feat_store.feat_folder, feat_store.file_prefix)
+
+    def __getattr__(self, name):
+        # get_filename, has_video, file_prefix, ...
+        if name in ('feat_store', 'cache', 'key_prefix'):
+            raise AttributeError(name)
+        return getattr(self.feat_store, name)
+
+    def get_num_feats(self, video_id):
+        # from the cache index if the video is cached (no file is read)
+        shape = self.cache.get_shape(self.key_prefix + video_id)
+        if shape is None:
+            return self.feat_store.get_num_feats(video_id)
+        return shape[0]
+
+    def open(self, video_id):
+        key = self.key_prefix + video_id
+        feats = self.cache.get(key)
+        if feats is None:
+            # decode the whole video once, in its stored dtype (e.g., float16),
+            # but int8 feats (mmap / pack) are cached dequantized, as float32
+            feats = self.feat_store.read_window(video_id, 0, None, dtype=None)
+            self.cache.put(key, feats)
+        return feats
+
+    def read_window(self, video_id, st, ed, step=1, dtype=np.float32):
+        # the whole video is cached, the window is sliced from it
+        return np.asarray(self.open(video_id)[st:ed:step], dtype=dtype)
+
+
+def get_feat_caches(dataset):
+    """all the feature caches used by a dataset (e.g., to report hits / misses)"""
+    stores = [getattr(dataset, 'feat_store', None)] + list(getattr(dataset, 'feat_stores', []))
+    caches = [store.cache for store in stores if isinstance(store, CachedFeatStore)]
+    # union of datasets
+    for sub_dataset in getattr(dataset, 'datasets', []):
+        caches += get_feat_caches(sub_dataset)
+    # each shared cache only once
+    return list({id(cache): cache for cache in caches}.values())
@@ -0,0 +1,325 @@
+import os
+import json
+import zipfile
+import numpy as np
+
+from .feat_cache import FeatCache, CachedFeatStore
+
+# feature stores (e.g., one npz file per video / per-clip feature folders / packed shards)
+feat_stores = {}
+def register_feat_store(name):
+    def decorator(cls):
+        feat_stores[name] = cls
+        return cls
+    return decorator
+
+def make_feat_store(name, feat_folder, file_prefix, file_ext, cache_gb=0, feat_cache=None):
+    """
+        A simple feature store builder
+        cache_gb > 0 keeps the decoded feats in a shared memory cache (see feat_cache.py),
+        or feat_cache: an existing FeatCache shared with other stores (cache_gb is ignored)
+    """
+    feat_store = feat_stores[name](feat_folder, file_prefix, file_ext)
+    if feat_cache is None and cache_gb > 0:
+        feat_cache = FeatCache(cache_gb)
+    if feat_cache is not None:
+        feat_store = CachedFeatStore(feat_store, feat_cache)
+    return feat_store
+
+
+class QuantizedFeatArray(object):
+    """
+        A lazy T x C view of int8 features quantized per channel
+        qparams (2 x C) holds the scale and zero point of each channel,
+        only the rows selected by indexing are dequantized (to float32)
+    """
+    def __init__(self, qfeats, qparams):
+        self.qfeats = qfeats
+        self.qparams = qparams
+        self.shape = qfeats.shape
+        self.dtype = np.dtype(np.float32)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        # support feats[rows] and feats[rows, cols]
+        if not isinstance(key, tuple):
+            key = (key, slice(None))
+        scale, zero_point = self.qparams[0][key[1]], self.qparams[1][key[1]]
+        return (self.qfeats[key].astype(np.float32) - zero_point) * scale
+
+    def __array__(self, dtype=None, copy=None):
+        feats = self[:]
+        return feats if dtype is None else feats.astype(dtype)
+
+
+@register_feat_store("npy")
+class NpyFeatStore(object):
+    """
+        One numpy array file per video (T x C)
+    """
+    def __init__(self, feat_folder, file_prefix, file_ext):
+        self.feat_folder = feat_folder
+        self.file_prefix = file_prefix
+        self.file_ext = file_ext
+
+    def get_filename(self, video_id):
+        return os.path.join(self.feat_folder,
+                            self.file_prefix + video_id + self.file_ext)
+
+    def has_video(self, video_id):
+        return os.path.exists(self.get_filename(video_id))
+
+    def open(self, video_id):
+        # T x C
+        return np.load(self.get_filename(video_id)).astype(np.float32)
+
+    def get_num_feats(self, video_id):
+        # T, only the header is read
+        return np.load(self.get_filename(video_id), mmap_mode='r').shape[0]
+
+    def read_window(self, video_id, st, ed, step=1, dtype=np.float32):
+        # rows [st:ed:step] (T x C), only those rows are read
+        # feats are cast to dtype (None keeps the stored dtype)
+        feats = np.load(self.get_filename(video_id), mmap_mode='r')
+        return np.asarray(feats[st:ed:step], dtype=dtype)
+
+
+@register_feat_store("npz")
+class NpzFeatStore(NpyFeatStore):
+    """
+        One numpy file per video (T x C), stored under the key 'feats'
+        This is the format written by compress_features.py / compress_numpy.py
+    """
+    def open(self, video_id):
+        # T x C
+        with np.load(self.get_filename(video_id)) as data:
+            feats = data['feats'].astype(np.float32)
+        return feats
+
+    @staticmethod
+    def _read_header(fid):
+        # shape, fortran_order and dtype of the array, fid is left at its first byte
+        version = np.lib.format.read_magic(fid)
+        if version == (1, 0):
+            return np.lib.format.read_array_header_1_0(fid)
+        return np.lib.format.read_array_header_2_0(fid)
+
+    def get_num_feats(self, video_id):
+        # T, from the header of the array (nothing is decompressed past it)
+        with zipfile.ZipFile(self.get_filename(video_id)) as data:
+            with data.open('feats.npy') as fid:
+                shape, _, _ = self._read_header(fid)
+        return shape[0]
+
+    def read_window(self, video_id, st, ed, step=1, dtype=np.float32):
+        """
+            rows [st:ed:step] (T x C) of a video
+            Uncompressed files (np.savez) are memory mapped, so only the window is
+            read. Compressed files are decompressed up to the end of the window.
+            Feats are cast to dtype (None keeps the stored dtype)
+        """
+        filename = self.get_filename(video_id)
+        with zipfile.ZipFile(filename) as data:
+            info = data.getinfo('feats.npy')
+            with data.open(info) as fid:
+                shape, fortran_order, feat_dtype = self._read_header(fid)
+                header_len = fid.tell()
+                if fortran_order:
+                    # rows are not contiguous, read the whole array
+                    feats = np.frombuffer(fid.read(), dtype=feat_dtype).reshape(shape, order='F')
+                    return np.asarray(feats[st:ed:step], dtype=dtype)
+                rows = range(shape[0])[st:ed]
+                st, ed = rows.start, rows.stop
+                row_bytes = int(np.prod(shape[1:])) * feat_dtype.itemsize
+                if info.compress_type != zipfile.ZIP_STORED:
+                    fid.seek(st * row_bytes, 1)
+                    buf = fid.read(max(ed - st, 0) * row_bytes)
+                    feats = np.frombuffer(buf, dtype=feat_dtype).reshape((-1, ) + shape[1:])
+                    return np.asarray(feats[::step], dtype=dtype)
+        # the member starts after its local header (30 bytes + name + extra field)
+        with open(filename, 'rb') as fid:
+            fid.seek(info.header_offset + 26)
+            name_len, extra_len = np.frombuffer(fid.read(4), dtype='<u2')
+        offset = info.header_offset + 30 + int(name_len) + int(extra_len) + header_len
+        feats = np.memmap(filename, dtype=feat_dtype, mode='r', offset=offset, shape=shape)
+        return np.asarray(feats[st:ed:step], dtype=dtype)
+
+
+@register_feat_store("mmap")
+class MmapFeatStore(object):
+    """
+        One uncompressed numpy file per video, stored channel first (C x T)
+        The file is memory mapped, so only the slices that are used are read
+        (see tools/convert_feats.py). Feats can be float32, float16 or int8,
+        int8 feats come with a <video_id>.qparams.npy file (2 x C)
+    """
+    def __init__(self, feat_folder, file_prefix, file_ext):
+        self.feat_folder = feat_folder
+        self.file_prefix = file_prefix
+        # always uncompressed .npy files
+        self.file_ext = '.npy'
+
+    def get_filename(self, video_id):
+        return os.path.join(self.feat_folder,
+                            self.file_prefix + video_id + self.file_ext)
+
+    def has_video(self, video_id):
+        return os.path.exists(self.get_filename(video_id))
+
+    def open(self, video_id):
+        # C x T on disk -> T x C view (no data is read here)
+        feats = np.load(self.get_filename(video_id), mmap_mode='r')
+        if feats.dtype == np.int8:
+            qparams = np.load(os.path.join(
+                self.feat_folder, self.file_prefix + video_id + '.qparams.npy'))
+            return QuantizedFeatArray(feats.T, qparams)
+        return feats.T
+
+    def get_num_feats(self, video_id):
+        # T (C x T on disk), only the header is read
+        return np.load(self.get_filename(video_id), mmap_mode='r').shape[1]
+
+    def read_window(self, video_id, st, ed, step=1, dtype=np.float32):
+        # rows [st:ed:step] (T x C), only those rows are read
+        return np.asarray(self.open(video_id)[st:ed:step], dtype=dtype)
+
+
+class ClipFeatArray(object):
+    """
+        A lazy T x C array over the per-clip feature files of a video
+        Only the rows selected by indexing are read from disk
+    """
+    def __init__(self, clip_files, feat_dim):
+        self.clip_files = clip_files
+        self.shape = (len(clip_files), feat_dim)
+        self.dtype = np.dtype(np.float32)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _load_row(self, row):
+        with np.load(self.clip_files[row]) as data:
+            return np.asarray(data['arr_0'], dtype=np.float32).reshape(-1)
+
+    def __getitem__(self, key):
+        # support feats[rows] and feats[rows, cols]
+        col_key = None
+        if isinstance(key, tuple):
+            key, col_key = key[0], key[1:]
+        if isinstance(key, (int, np.integer)):
+            feats = self._load_row(range(len(self))[key])
+        else:
+            rows = range(len(self))[key]
+            feats = np.empty((len(rows), self.shape[1]), dtype=np.float32)
+            for idx, row in enumerate(rows):
+                feats[idx] = self._load_row(row)
+        if col_key:
+            feats = feats[(Ellipsis, ) + col_key]
+        return feats
+
+    def __array__(self, dtype=None, copy=None):
+        feats = self[:]
+        return feats if dtype is None else feats.astype(dtype)
+
+
+@register_feat_store("clips")
+class ClipFeatStore(object):
+    """
+        Per-clip feature folders written by Gluon CV (e.g., P01_1_clips/12.mp4_<model>_feat.npz)
+        seen as a single logical T x C array per video (a virtual concatenation).
+        Clip files are indexed once and the rows are read lazily.
+        Folders and clips are named as in compress_features.py: the video id is
+        given by the first two '_' separated tokens of the folder name, and the
+        clips are sorted by the number before their first '.'
+    """
+    def __init__(self, feat_folder, file_prefix, file_ext):
+        self.feat_folder = feat_folder
+        self.file_prefix = file_prefix
+        # per-clip files are always .npz from the extractor
+        self.file_ext = '.npz'
+        self.feat_dim = None
+
+        # index all clip folders (one listdir per video)
+        self.clip_index = {}
+        for entry in os.scandir(feat_folder):
+            if not entry.is_dir():
+                continue
+            clips = [f for f in os.listdir(entry.path) if f.endswith(self.file_ext)]
+            clips = sorted(clips, key=lambda x: int(x.split('.')[0]))
+            self.clip_index['_'.join(entry.name.split('_')[0:2])] = \
+                [os.path.join(entry.path, f) for f in clips]
+
+    def has_video(self, video_id):
+        return (self.file_prefix + video_id) in self.clip_index
+
+    def open(self, video_id):
+        clip_files = self.clip_index[self.file_prefix + video_id]
+        # all clips share the same feature dim, read it once from the first clip
+        if self.feat_dim is None:
+            with np.load(clip_files[0]) as data:
+                self.feat_dim = data['arr_0'].size
+        return ClipFeatArray(clip_files, self.feat_dim)
+
+    def get_num_feats(self, video_id):
+        # one feat per clip
+        return len(self.clip_index[self.file_prefix + video_id])
+
+    def read_window(self, video_id, st, ed, step=1, dtype=np.float32):
+        # rows [st:ed:step] (T x C), only those rows are read
+        return np.asarray(self.open(video_id)[st:ed:step], dtype=dtype)
+
+
+@register_feat_store("pack")
+class PackFeatStore(object):
+    """
+        All videos packed into a few large shard files (see tools/convert_feats.py)
+        feat_folder holds the shards and index.json, which maps each video to
+        (shard, byte offset, T, C, dtype). Each video is stored as T x C, so a
+        temporal window is a single contiguous read from a memory mapped shard.
+        int8 feats have an extra byte offset to their qparams (2 x C float32)
+    """
+    def __init__(self, feat_folder, file_prefix, file_ext):
+        self.feat_folder = feat_folder
+        self.file_prefix = file_prefix
+        with open(os.path.join(feat_folder, 'index.json'), 'r') as fid:
+            index = json.load(fid)
+        self.shards = [os.path.join(feat_folder, f) for f in index['shards']]
+        self.videos = index['videos']
+        # shards are mapped lazily (once per worker)
+        self.shard_maps = {}
+
+    def __getstate__(self):
+        # never pickle the memory maps (e.g., when spawning workers)
+        state = self.__dict__.copy()
+        state['shard_maps'] = {}
+        return state
+
+    def has_video(self, video_id):
+        return (self.file_prefix + video_id) in self.videos
+
+    def get_num_feats(self, video_id):
+        return self.videos[self.file_prefix + video_id][2]
+
+    def read_window(self, video_id, st, ed, step=1, dtype=np.float32):
+        # rows [st:ed:step] (T x C), only those rows are read
+        return np.asarray(self.open(video_id)[st:ed:step], dtype=dtype)
+
+    def open(self, video_id):
+        entry = self.videos[self.file_prefix + video_id]
+        shard, offset, num_feats, feat_dim, dtype = entry[:5]
+        if shard not in self.shard_maps:
+            self.shard_maps[shard] = np.memmap(
+                self.shards[shard], dtype=np.uint8, mode='r')
+        shard_map = self.shard_maps[shard]
+        dtype = np.dtype(dtype)
+        num_bytes = num_feats * feat_dim * dtype.itemsize
+        # T x C view (no data is read here)
+        feats = shard_map[offset:offset + num_bytes]
+        feats = feats.view(dtype).reshape(num_feats, feat_dim)
+        if dtype == np.int8:
+            qparams_offset = entry[5]
+            qparams = shard_map[qparams_offset:qparams_offset + 2 * feat_dim * 4]
+            return QuantizedFeatArray(feats, qparams.view(np.float32).reshape(2, feat_dim))
+        return feats
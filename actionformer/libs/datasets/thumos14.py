@@ -7,7 +7,9 @@ from torch.utils.data import Dataset
 from torch.nn import functional as F
 
 from .datasets import register_dataset
-from .data_utils import truncate_feats
+from .data_utils import (sample_trunc_window, apply_trunc_window, get_trunc_windows, get_seq_lens,
+                          get_num_feats, load_cached_db)
+from .feat_stores import make_feat_store
 
 @register_dataset("thumos")
 class THUMOS14Dataset(Dataset):
@@ -28,7 +30,10 @@ class THUMOS14Dataset(Dataset):
         num_classes,     # number of action categories
         file_prefix,     # feature file prefix if any
         file_ext,        # feature file extension if any
-        force_upsampling # force to upsample to max_seq_len
+        force_upsampling, # force to upsample to max_seq_len
+        feat_backend='npy', # storage format of the feats (npy | npz | mmap | pack)
+        feat_cache_gb=0,   # size of the shared feature cache in GB, 0 to disable
+        feat_cache=None    # a FeatCache shared with other datasets (overrides feat_cache_gb)
     ):
         # file path
         assert os.path.exists(feat_folder) and os.path.exists(json_file)
@@ -41,6 +46,8 @@ class THUMOS14Dataset(Dataset):
             self.file_prefix = ''
         self.file_ext = file_ext
         self.json_file = json_file
+        self.feat_store = make_feat_store(
+            feat_backend, feat_folder, self.file_prefix, file_ext, feat_cache_gb, feat_cache)
 
         # split / training mode
         self.split = split
@@ -63,6 +70,10 @@ class THUMOS14Dataset(Dataset):
         assert len(label_dict) == num_classes
         self.data_list = dict_db
         self.label_dict = label_dict
+        # number of feats of each video (store metadata is only read once)
+        self.num_feats = get_num_feats(self.data_list, self.feat_store)
+        # valid truncation windows of the long videos (built once, sampled directly)
+        self.trunc_windows = self._get_trunc_windows() if is_training else {}
 
         # dataset specific attributes
         self.db_attributes = {
@@ -76,6 +87,14 @@ class THUMOS14Dataset(Dataset):
         return self.db_attributes
 
     def _load_json_db(self, json_file):
+        # parsed once, then loaded from the annotation cache
+        dict_db, label_dict = load_cached_db(
+            json_file, ('thumos', tuple(sorted(self.split)), self.default_fps), self._parse_json_db)
+        # skip the videos that do not have the feature file
+        dict_db = tuple(item for item in dict_db if self.feat_store.has_video(item['id']))
+        return dict_db, label_dict
+
+    def _parse_json_db(self, json_file):
         # load database and select the subset
         with open(json_file, 'r') as fid:
             json_data = json.load(fid)
@@ -89,16 +108,11 @@ class THUMOS14Dataset(Dataset):
                     label_dict[act['label']] = act['label_id']
 
         # fill in the db (immutable afterwards)
-        dict_db = tuple()
+        dict_db = []
         for key, value in json_db.items():
             # skip the video if not in the split
             if value['subset'].lower() not in self.split:
                 continue
-            # or does not have the feature file
-            feat_file = os.path.join(self.feat_folder,
-                                     self.file_prefix + key + self.file_ext)
-            if not os.path.exists(feat_file):
-                continue
 
             # get fps if available
             if self.default_fps is not None:
@@ -128,14 +142,24 @@ class THUMOS14Dataset(Dataset):
             else:
                 segments = None
                 labels = None
-            dict_db += ({'id': key,
-                         'fps' : fps,
-                         'duration' : duration,
-                         'segments' : segments,
-                         'labels' : labels
-            }, )
+            dict_db.append({'id': key,
+                            'fps' : fps,
+                            'duration' : duration,
+                            'segments' : segments,
+                            'labels' : labels
+            })
 
-        return dict_db, label_dict
+        return tuple(dict_db), label_dict
+
+    def _get_trunc_windows(self):
+        # valid truncation windows of each video longer than max_seq_len
+        return get_trunc_windows(
+            self.data_list, self.num_feats, self.feat_stride, self.num_frames,
+            self.downsample_rate, self.max_seq_len, self.trunc_thresh)
+
+    def get_seq_lens(self):
+        # length of each video after downsampling / truncation (used to bucket batches)
+        return get_seq_lens(self.data_list, self.num_feats, self.downsample_rate, self.max_seq_len)
 
     def __len__(self):
         return len(self.data_list)
@@ -146,17 +170,13 @@ class THUMOS14Dataset(Dataset):
         # instead the model will need to decide how to batch / preporcess the data
         video_item = self.data_list[idx]
 
-        # load features
-        filename = os.path.join(self.feat_folder,
-                                self.file_prefix + video_item['id'] + self.file_ext)
-        feats = np.load(filename).astype(np.float32)
+        # number of feats (built with the dataset, nothing is read yet)
+        num_feats = self.num_feats[video_item['id']]
 
         # deal with downsampling (= increased feat stride)
-        feats = feats[::self.downsample_rate, :]
+        feat_len = len(range(0, num_feats, self.downsample_rate))
         feat_stride = self.feat_stride * self.downsample_rate
         feat_offset = 0.5 * self.num_frames / feat_stride
-        # T x C -> C x T
-        feats = torch.from_numpy(np.ascontiguousarray(feats.transpose()))
 
         # convert time stamp (in second) into temporal feature grids
         # ok to have small negative values here
@@ -168,6 +188,21 @@ class THUMOS14Dataset(Dataset):
         else:
             segments, labels = None, None
 
+        # pick the truncation window during training before reading the feats
+        window = None
+        if self.is_training and (segments is not None):
+            window = sample_trunc_window(
+                feat_len, segments, self.max_seq_len, self.trunc_thresh, feat_offset, self.crop_ratio,
+                valid_windows=self.trunc_windows.get(video_item['id'])
+            )
+        st, ed = window if window is not None else (0, feat_len)
+
+        # only read the rows we keep (T x C)
+        feats = self.feat_store.read_window(
+            video_item['id'], st * self.downsample_rate, ed * self.downsample_rate, self.downsample_rate)
+        # T x C -> C x T
+        feats = torch.from_numpy(np.ascontiguousarray(feats.transpose()))
+
         # return a data dict
         data_dict = {'video_id'        : video_item['id'],
                      'feats'           : feats,      # C x T
@@ -178,10 +213,10 @@ class THUMOS14Dataset(Dataset):
                      'feat_stride'     : feat_stride,
                      'feat_num_frames' : self.num_frames}
 
-        # truncate the features during training
-        if self.is_training and (segments is not None):
-            data_dict = truncate_feats(
-                data_dict, self.max_seq_len, self.trunc_thresh, feat_offset, self.crop_ratio
+        # truncate the time stamps during training
+        if window is not None:
+            data_dict = apply_trunc_window(
+                data_dict, window, self.trunc_thresh, feat_offset, feats_truncated=True
             )
 
         return data_dict
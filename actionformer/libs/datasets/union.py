@@ -0,0 +1,133 @@
+import bisect
+import numpy as np
+
+from torch.utils.data import Dataset
+
+from .datasets import register_dataset, make_dataset
+from .feat_cache import FeatCache
+
+@register_dataset("union")
+class UnionDataset(Dataset):
+    """
+        A virtual union of several datasets (e.g., EPIC-Kitchens + BSH), each one
+        with its own feat_folder, json_file and video id namespace. Nothing is
+        renamed or copied on disk: video ids are prefixed on the fly.
+
+        Each source in sources is a dict with
+            name: name of the source (default id prefix is <name>_)
+            dataset_name: registered dataset of the source (default: epic)
+            weight: optional sampling weight of the source in training (see below)
+            id_prefix: prefix of the video ids of the source
+            splits: optional map from the requested split to the subsets of the
+                    source (e.g., {training: [training, validation]}). A split
+                    that is not in the map is not used from this source.
+            any other key overrides the shared dataset arguments (json_file,
+            feat_folder, file_prefix, file_ext, default_fps, ...)
+
+        Without any source weight, the training videos are shuffled as usual (each
+        video once per epoch). If a source sets a weight (the sources without one
+        get 1.0), each source is sampled in proportion to its weight, with
+        replacement: an epoch is then len(dataset) draws, where some videos of a
+        small source may be seen several times and some videos of a large source
+        not at all.
+
+        With feat_cache_gb > 0, all the sources share a single feature cache
+        of feat_cache_gb (a feat_cache_gb of a source is ignored).
+    """
+    def __init__(
+        self,
+        is_training,     # if in training mode
+        split,           # split, a tuple/list allowing concat of subsets
+        sources,         # list of sources (see above)
+        **kwargs         # dataset arguments shared by all sources
+    ):
+        assert isinstance(split, tuple) or isinstance(split, list)
+        assert len(sources) > 0
+        self.split = split
+        self.is_training = is_training
+
+        self.datasets, self.names, self.id_prefixes, self.weights = [], [], [], []
+        self.json_file = []
+        # a single feature cache (and budget) for all the sources
+        feat_cache_gb = kwargs.pop('feat_cache_gb', 0)
+        feat_cache = FeatCache(feat_cache_gb) if feat_cache_gb > 0 else None
+        for source in sources:
+            source = dict(source)
+            name = source.pop('name')
+            dataset_name = source.pop('dataset_name', 'epic')
+            weight = source.pop('weight', None)
+            id_prefix = source.pop('id_prefix', name + '_')
+            split_map = source.pop('splits', None)
+            if split_map is None:
+                source_split = list(split)
+            else:
+                source_split = [s for x in split for s in split_map.get(x, [])]
+            if len(source_split) == 0:
+                continue
+
+            dataset_args = dict(kwargs)
+            dataset_args.update(source)
+            dataset_args.pop('feat_cache_gb', None)
+            if feat_cache is not None:
+                dataset_args['feat_cache'] = feat_cache
+            self.datasets.append(make_dataset(
+                dataset_name, is_training, source_split, **dataset_args))
+            self.names.append(name)
+            self.id_prefixes.append(id_prefix)
+            self.weights.append(weight)
+            # ground truth of each source for the evaluator
+            self.json_file.append({'json_file': dataset_args['json_file'],
+                                   'split': source_split,
+                                   'prefix': id_prefix})
+        assert len(self.datasets) > 0, "No source has videos in this split."
+        self.cum_sizes = np.cumsum([len(d) for d in self.datasets]).tolist()
+
+        # video list with the ids in their namespace
+        self.data_list = tuple(
+            dict(item, id=prefix + item['id'])
+            for dataset, prefix in zip(self.datasets, self.id_prefixes)
+            for item in dataset.data_list
+        )
+
+        # dataset specific attributes, a category is empty if it is empty in every source
+        attributes = [d.get_attributes() for d in self.datasets]
+        empty_label_ids = set(attributes[0]['empty_label_ids'])
+        for attribute in attributes[1:]:
+            empty_label_ids &= set(attribute['empty_label_ids'])
+        self.db_attributes = {
+            'dataset_name': 'union',
+            'tiou_thresholds': attributes[0]['tiou_thresholds'],
+            'empty_label_ids': sorted(empty_label_ids)
+        }
+
+    def get_attributes(self):
+        return self.db_attributes
+
+    def get_sample_weights(self):
+        # no weights (plain shuffling) unless a source sets its weight
+        if all(weight is None for weight in self.weights):
+            return None
+        # each source is sampled in proportion to its weight (not its size)
+        sample_weights = []
+        for dataset, weight in zip(self.datasets, self.weights):
+            weight = 1.0 if weight is None else float(weight)
+            sample_weights += [weight / max(len(dataset), 1)] * len(dataset)
+        return sample_weights
+
+    def get_seq_lens(self):
+        seq_lens = []
+        for name, dataset in zip(self.names, self.datasets):
+            assert hasattr(dataset, 'get_seq_lens'), \
+                "Source {:s} does not support length bucketing".format(name)
+            seq_lens += dataset.get_seq_lens()
+        return seq_lens
+
+    def __len__(self):
+        return self.cum_sizes[-1]
+
+    def __getitem__(self, idx):
+        source_idx = bisect.bisect_right(self.cum_sizes, idx)
+        start = self.cum_sizes[source_idx - 1] if source_idx > 0 else 0
+        data_dict = self.datasets[source_idx][idx - start]
+        data_dict['video_id'] = self.id_prefixes[source_idx] + data_dict['video_id']
+        return data_dict
@@ -51,6 +51,117 @@ def sigmoid_focal_loss(
     return loss
 
 
+@torch.jit.script
+def _sigmoid_focal_loss_const(
+    inputs: torch.Tensor,
+    target: float,
+    alpha: float = 0.25,
+    gamma: float = 2.0,
+) -> torch.Tensor:
+    # sigmoid_focal_loss (reduction='none') with the same target for all the inputs
+    p = torch.sigmoid(inputs)
+    # binary cross entropy with logits (in its stable form)
+    ce_loss = torch.clamp(inputs, min=0) - inputs * target + \
+              torch.log1p(torch.exp(-torch.abs(inputs)))
+    p_t = p * target + (1 - p) * (1 - target)
+    loss = ce_loss * ((1 - p_t) ** gamma)
+
+    if alpha >= 0:
+        loss = (alpha * target + (1 - alpha) * (1 - target)) * loss
+
+    return loss
+
+
+@torch.jit.script
+def _sigmoid_focal_loss_const_grad(
+    inputs: torch.Tensor,
+    target: float,
+    alpha: float = 0.25,
+    gamma: float = 2.0,
+) -> torch.Tensor:
+    # derivative of _sigmoid_focal_loss_const w.r.t. the inputs
+    p = torch.sigmoid(inputs)
+    ce_loss = torch.clamp(inputs, min=0) - inputs * target + \
+              torch.log1p(torch.exp(-torch.abs(inputs)))
+    # 1 - p_t
+    q = p + target - 2 * p * target
+    grad = (p - target) * (q ** gamma)
+    if gamma != 0:
+        grad = grad + ce_loss * gamma * (q ** (gamma - 1)) * p * (1 - p) * (1 - 2 * target)
+
+    if alpha >= 0:
+        grad = (alpha * target + (1 - alpha) * (1 - target)) * grad
+
+    return grad
+
+
+class _SumSigmoidFocalLossConst(torch.autograd.Function):
+    """
+    Sum of _sigmoid_focal_loss_const over N x C inputs, computed chunk_size
+    rows at a time. Only the inputs are kept for the backward pass, which
+    computes the gradient (in closed form) with the same chunks, so the
+    N x C intermediates of the loss are never materialized.
+    """
+    @staticmethod
+    def forward(ctx, inputs, target, alpha, gamma, chunk_size):
+        ctx.save_for_backward(inputs)
+        ctx.target, ctx.alpha, ctx.gamma, ctx.chunk_size = target, alpha, gamma, chunk_size
+        loss = inputs.new_zeros(())
+        for chunk in inputs.split(chunk_size):
+            loss += _sigmoid_focal_loss_const(chunk, target, alpha, gamma).sum()
+        return loss
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        inputs, = ctx.saved_tensors
+        grad = torch.empty_like(inputs)
+        for chunk, grad_chunk in zip(inputs.split(ctx.chunk_size), grad.split(ctx.chunk_size)):
+            grad_chunk.copy_(_sigmoid_focal_loss_const_grad(chunk, ctx.target, ctx.alpha, ctx.gamma))
+        grad.mul_(grad_output)
+        return grad, None, None, None, None
+
+
+def sparse_sigmoid_focal_loss(
+    inputs: torch.Tensor,
+    pos_inds: torch.Tensor,
+    pos_target: float = 1.0,
+    neg_target: float = 0.0,
+    alpha: float = 0.25,
+    gamma: float = 2.0,
+    chunk_size: int = 2 ** 20,
+) -> torch.Tensor:
+    """
+    Summed sigmoid_focal_loss of N x C inputs whose targets are neg_target
+    everywhere but on a few positives, given as (row, class) pairs, which are
+    pos_target (e.g., the one hot targets after label smoothing).
+    No dense targets are built: the loss of all the inputs as negatives is
+    computed from the inputs only, by chunks of about chunk_size elements (so
+    no N x C intermediates are kept, only the N x C gradient of the inputs),
+    and then fixed on the positives.
+
+    Args:
+        inputs: A float tensor of size (N, C).
+        pos_inds: A long tensor of size (K, 2), the (row, class) pairs of
+                  the positives (without duplicates).
+        pos_target / neg_target: the targets of the positives / negatives.
+        alpha, gamma: see sigmoid_focal_loss.
+        chunk_size: number of elements of the inputs processed at a time.
+    Returns:
+        Loss tensor (sum of the loss of all the inputs).
+    """
+    inputs = inputs.float()
+    chunk_rows = max(chunk_size // max(inputs.shape[-1], 1), 1)
+    loss = _SumSigmoidFocalLossConst.apply(inputs, neg_target, alpha, gamma, chunk_rows)
+
+    pos_inputs = inputs[pos_inds[:, 0], pos_inds[:, 1]]
+    loss = loss + (
+        _sigmoid_focal_loss_const(pos_inputs, pos_target, alpha, gamma)
+        - _sigmoid_focal_loss_const(pos_inputs, neg_target, alpha, gamma)
+    ).sum()
+
+    return loss
+
+
 @torch.jit.script
 def ctr_giou_loss_1d(
     input_offsets: torch.Tensor,
@@ -6,7 +6,7 @@ from torch.nn import functional as F
 
 from .models import register_meta_arch, make_backbone, make_neck, make_generator
 from .blocks import MaskedConv1D, Scale, LayerNorm
-from .losses import ctr_diou_loss_1d, sigmoid_focal_loss
+from .losses import ctr_diou_loss_1d, sparse_sigmoid_focal_loss
 
 from ..utils import batched_nms
 
@@ -159,6 +159,162 @@ class PtTransformerRegHead(nn.Module):
         return out_offsets
 
 
+class TargetAssigner(object):
+    """
+        Assigns the classification / regression targets of the points on all
+        fpn levels to the ground truth actions of each video.
+        A plain (picklable) object, so that the targets can also be assigned in
+        the data loader workers (see PaddedBatchCollator)
+    """
+    def __init__(
+        self,
+        num_classes,          # number of action classes
+        center_sample,        # center sampling of the positives (radius | none)
+        center_sample_radius, # radius of the center sampling (in fpn strides)
+        fpn_strides=None,     # strides of fpn levels (only to build the points)
+        buffer_points=None    # List[T x 4] points of each fpn level (only to build the points)
+    ):
+        self.num_classes = num_classes
+        self.center_sample = center_sample
+        self.center_sample_radius = center_sample_radius
+        self.fpn_strides = fpn_strides
+        self.buffer_points = buffer_points
+
+    def get_points(self, seq_len):
+        # points of an input of seq_len (padded) features, as given by the point generator
+        return [pts[:seq_len // stride] for pts, stride in zip(self.buffer_points, self.fpn_strides)]
+
+    def __call__(self, seq_len, gt_segments, gt_labels):
+        # targets of a batch padded to seq_len
+        return self.label_points(self.get_points(seq_len), gt_segments, gt_labels)
+
+    def _candidate_pairs(self, points, gt_segs):
+        """
+            (point, segment) pairs where the point may be assigned to the segment
+            points: List[T x 4] (sorted by time on each level); gt_segs: M x 2
+            The points of each level are sorted, so the points inside a segment are
+            a contiguous range found by binary search (widened by one point on each
+            side, exact tests are done on the pairs). Levels whose regression range
+            cannot hold the segment (max distance in [L / 2, L]) are skipped.
+            Returns the point index (in the concatenated points) and segment index
+        """
+        seg_lens = gt_segs[:, 1] - gt_segs[:, 0]
+        pair_pts, pair_segs = [], []
+        level_start = 0
+        for pts in points:
+            ts, stride = pts[:, 0].contiguous(), pts[0, 3]
+            reg_min, reg_max = pts[0, 1], pts[0, 2]
+            lo, hi = gt_segs[:, 0], gt_segs[:, 1]
+            if self.center_sample == 'radius':
+                center_pts = 0.5 * (gt_segs[:, 0] + gt_segs[:, 1])
+                lo = torch.maximum(center_pts - stride * self.center_sample_radius, lo)
+                hi = torch.minimum(center_pts + stride * self.center_sample_radius, hi)
+            # first point > lo and last point < hi (+ one point of margin)
+            st = (torch.searchsorted(ts, lo.contiguous(), right=True) - 1).clamp(min=0)
+            ed = (torch.searchsorted(ts, hi.contiguous(), right=False) + 1).clamp(max=len(ts))
+            counts = (ed - st).clamp(min=0)
+            # regression range of the level (with a margin of one grid)
+            counts[(seg_lens < reg_min - 1) | (0.5 * seg_lens > reg_max + 1)] = 0
+
+            seg_inds = torch.repeat_interleave(torch.arange(len(counts), device=counts.device), counts)
+            first_pair = torch.cumsum(counts, 0) - counts
+            pt_inds = torch.arange(len(seg_inds), device=counts.device) \
+                      - first_pair[seg_inds] + st[seg_inds]
+            pair_pts.append(pt_inds + level_start)
+            pair_segs.append(seg_inds)
+            level_start += len(ts)
+        return torch.cat(pair_pts), torch.cat(pair_segs)
+
+    @torch.no_grad()
+    def label_points(self, points, gt_segments, gt_labels):
+        """
+            Targets of all the videos in a mini-batch at once
+            points: List[T x 4] (t, regression range, stride) shared by all videos
+            gt_segments: List[N x 2]; gt_labels: List[N]
+            Only the (point, segment) pairs where the point is inside the segment
+            are tested, instead of all F T x N pairs of each video.
+            Returns List[K x 2] cls targets, the (point, class) pairs of the positives
+            (the ones of F T x C one hot targets), and List[F T x 2] reg targets
+        """
+        concat_points = torch.cat(points, dim=0)
+        num_pts, num_vids = concat_points.shape[0], len(gt_segments)
+        num_gts = [gt_segment.shape[0] for gt_segment in gt_segments]
+        gt_segs = torch.cat(gt_segments, dim=0)
+        gt_labs = torch.cat(gt_labels, dim=0)
+        device = concat_points.device
+        # video of each segment, and its index in the video
+        seg_vids = torch.repeat_interleave(
+            torch.arange(num_vids, device=device), torch.as_tensor(num_gts, device=device))
+        seg_starts = torch.cumsum(torch.as_tensor(num_gts, device=device), 0) - \
+                     torch.as_tensor(num_gts, device=device)
+        seg_local_inds = torch.arange(len(gt_segs), device=device) - seg_starts[seg_vids]
+
+        # candidate pairs, then the exact tests on each pair
+        pt_inds, seg_inds = self._candidate_pairs(points, gt_segs)
+        pts = concat_points[pt_inds]
+        segs = gt_segs[seg_inds]
+        left = pts[:, 0] - segs[:, 0]
+        right = segs[:, 1] - pts[:, 0]
+        if self.center_sample == 'radius':
+            center_pts = 0.5 * (segs[:, 0] + segs[:, 1])
+            t_mins = center_pts - pts[:, 3] * self.center_sample_radius
+            t_maxs = center_pts + pts[:, 3] * self.center_sample_radius
+            cb_dist_left = pts[:, 0] - torch.maximum(t_mins, segs[:, 0])
+            cb_dist_right = torch.minimum(t_maxs, segs[:, 1]) - pts[:, 0]
+            inside_gt_seg_mask = torch.minimum(cb_dist_left, cb_dist_right) > 0
+        else:
+            inside_gt_seg_mask = torch.minimum(left, right) > 0
+        max_regress_distance = torch.maximum(left, right)
+        inside_regress_range = torch.logical_and(
+            (max_regress_distance >= pts[:, 1]),
+            (max_regress_distance <= pts[:, 2])
+        )
+        valid = torch.logical_and(inside_gt_seg_mask, inside_regress_range)
+        pt_inds, seg_inds = pt_inds[valid], seg_inds[valid]
+        lens = gt_segs[seg_inds, 1] - gt_segs[seg_inds, 0]
+        # one slot per (video, point)
+        keys = seg_vids[seg_inds] * num_pts + pt_inds
+
+        # if there are still more than one actions for one moment
+        # pick the one with the shortest duration (the first one on ties)
+        min_len = lens.new_full((num_vids * num_pts, ), float('inf'))
+        min_len.scatter_reduce_(0, keys, lens, reduce='amin')
+        is_min = lens == min_len[keys]
+        min_len_inds = torch.zeros(num_vids * num_pts, dtype=torch.long, device=device)
+        min_len_inds.index_fill_(0, keys[is_min], len(gt_segs))
+        min_len_inds.scatter_reduce_(0, keys[is_min], seg_local_inds[seg_inds[is_min]], reduce='amin')
+
+        # corner case: multiple actions with very similar durations (e.g., THUMOS14)
+        # cls_targets: unique (video, point, class) keys, sorted by video and point
+        min_len_mask = lens <= (min_len[keys] + 1e-3)
+        cls_keys = torch.unique(
+            keys[min_len_mask] * self.num_classes + gt_labs[seg_inds[min_len_mask]])
+        cls_targets = torch.stack((
+            torch.div(cls_keys, self.num_classes, rounding_mode='floor') % num_pts,
+            cls_keys % self.num_classes), dim=-1)
+        num_cls_targets = torch.bincount(
+            torch.div(cls_keys, num_pts * self.num_classes, rounding_mode='floor'),
+            minlength=num_vids)
+        gt_cls = list(torch.split(cls_targets, num_cls_targets.tolist()))
+
+        # reg_targets: B x F T x 2, from the selected segment (the first one if none)
+        min_len_inds = min_len_inds.view(num_vids, num_pts)
+        gt_offset = []
+        for vid_idx, gt_segment in enumerate(gt_segments):
+            if num_gts[vid_idx] == 0:
+                gt_offset.append(gt_segment.new_zeros((num_pts, 2)))
+                continue
+            sel_segs = gt_segment[min_len_inds[vid_idx]]
+            reg_targets = torch.stack((
+                concat_points[:, 0] - sel_segs[:, 0],
+                sel_segs[:, 1] - concat_points[:, 0]), dim=-1)
+            # normalization based on stride
+            reg_targets /= concat_points[:, 3, None]
+            gt_offset.append(reg_targets)
+
+        return gt_cls, gt_offset
+
+
 @register_meta_arch("LocPointTransformer")
 class PtTransformer(nn.Module):
     """
@@ -228,6 +384,7 @@ class PtTransformer(nn.Module):
         self.train_dropout = train_cfg['dropout']
         self.train_droppath = train_cfg['droppath']
         self.train_label_smoothing = train_cfg['label_smoothing']
+        self.train_dynamic_padding = train_cfg['dynamic_padding']
         self.alpha = train_cfg['alpha']
 
         # test time config
@@ -360,6 +517,10 @@ class PtTransformer(nn.Module):
             with_ln=head_with_ln
         )
 
+        # ground truth targets of the points
+        self.target_assigner = TargetAssigner(
+            self.num_classes, self.train_center_sample, self.train_center_sample_radius)
+
         # maintain an EMA of #foreground to stabilize the loss normalizer
         # useful for small mini-batch training
         self.loss_normalizer = train_cfg['init_loss_norm']
@@ -374,6 +535,10 @@ class PtTransformer(nn.Module):
     def forward(self, video_list):
         # batch the video list into feats (B, C, T) and masks (B, 1, T)
         batched_inputs, batched_masks = self.preprocessing(video_list)
+        batch = None
+        if isinstance(video_list, dict):
+            # already batched in the data loader workers
+            batch, video_list = video_list, video_list['video_list']
 
         # forward the network (backbone -> neck -> heads)
         feats, masks = self.backbone(batched_inputs, batched_masks)
@@ -403,13 +568,20 @@ class PtTransformer(nn.Module):
             # generate segment/lable List[N x 2] / List[N] with length = B
             assert video_list[0]['segments'] is not None, "GT action labels does not exist"
             assert video_list[0]['labels'] is not None, "GT action labels does not exist"
-            gt_segments = [x['segments'].to(self.device) for x in video_list]
-            gt_labels = [x['labels'].to(self.device) for x in video_list]
+            if batch is not None and 'gt_cls_labels' in batch:
+                # targets assigned in the data loader workers
+                gt_cls_labels = [x.to(self.device) for x in batch['gt_cls_labels']]
+                gt_offsets = [x.to(self.device) for x in batch['gt_offsets']]
+                assert gt_offsets[0].shape[0] == sum(pts.shape[0] for pts in points), \
+                    "Targets from the workers do not match the points"
+            else:
+                gt_segments = [x['segments'].to(self.device) for x in video_list]
+                gt_labels = [x['labels'].to(self.device) for x in video_list]
 
-            # compute the gt labels for cls & reg
-            # list of prediction targets
-            gt_cls_labels, gt_offsets = self.label_points(
-                points, gt_segments, gt_labels)
+                # compute the gt labels for cls & reg
+                # list of prediction targets
+                gt_cls_labels, gt_offsets = self.label_points(
+                    points, gt_segments, gt_labels)
 
             # compute the loss and return
             losses = self.losses(
@@ -427,19 +599,40 @@ class PtTransformer(nn.Module):
             )
             return results
 
+    def get_batch_padding(self):
+        """
+            Padding of the inputs, for batches padded in the data loader workers
+            (see PaddedBatchCollator, which follows preprocessing)
+        """
+        return {'max_seq_len': self.max_seq_len,
+                'max_div_factor': self.max_div_factor,
+                'dynamic_padding': self.train_dynamic_padding}
+
     @torch.no_grad()
     def preprocessing(self, video_list, padding_val=0.0):
         """
             Generate batched features and masks from a list of dict items
+            (or from a batch padded by PaddedBatchCollator)
         """
+        if isinstance(video_list, dict):
+            # only push to device (pinned feats are copied asynchronously)
+            batched_inputs = video_list['feats'].to(self.device, non_blocking=True).float()
+            batched_masks = video_list['masks'].to(self.device, non_blocking=True)
+            return batched_inputs, batched_masks
+
         feats = [x['feats'] for x in video_list]
         feats_lens = torch.as_tensor([feat.shape[-1] for feat in feats])
         max_len = feats_lens.max(0).values.item()
 
         if self.training:
             assert max_len <= self.max_seq_len, "Input length must be smaller than max_seq_len during training"
-            # set max_len to self.max_seq_len
-            max_len = self.max_seq_len
+            if self.train_dynamic_padding:
+                # pad to the longest input in the batch (rounded to the next divisible size)
+                stride = self.max_div_factor
+                max_len = (max_len + (stride - 1)) // stride * stride
+            else:
+                # set max_len to self.max_seq_len
+                max_len = self.max_seq_len
             # batch input shape B, C, T
             batch_shape = [len(feats), feats[0].shape[0], max_len]
             batched_inputs = feats[0].new_full(batch_shape, padding_val)
@@ -461,131 +654,50 @@ class PtTransformer(nn.Module):
         # generate the mask
         batched_masks = torch.arange(max_len)[None, :] < feats_lens[:, None]
 
-        # push to device
-        batched_inputs = batched_inputs.to(self.device)
+        # push to device (feats may be stored in half precision)
+        batched_inputs = batched_inputs.to(self.device).float()
         batched_masks = batched_masks.unsqueeze(1).to(self.device)
 
         return batched_inputs, batched_masks
 
     @torch.no_grad()
     def label_points(self, points, gt_segments, gt_labels):
-        # concat points on all fpn levels List[T x 4] -> F T x 4
-        # This is shared for all samples in the mini-batch
-        num_levels = len(points)
-        concat_points = torch.cat(points, dim=0)
-        gt_cls, gt_offset = [], []
+        # see TargetAssigner
+        return self.target_assigner.label_points(points, gt_segments, gt_labels)
 
-        # loop over each video sample
-        for gt_segment, gt_label in zip(gt_segments, gt_labels):
-            cls_targets, reg_targets = self.label_points_single_video(
-                concat_points, gt_segment, gt_label
-            )
-            # append to list (len = # images, each of size FT x C)
-            gt_cls.append(cls_targets)
-            gt_offset.append(reg_targets)
-
-        return gt_cls, gt_offset
-
-    @torch.no_grad()
-    def label_points_single_video(self, concat_points, gt_segment, gt_label):
-        # concat_points : F T x 4 (t, regression range, stride)
-        # gt_segment : N (#Events) x 2
-        # gt_label : N (#Events) x 1
-        num_pts = concat_points.shape[0]
-        num_gts = gt_segment.shape[0]
-
-        # corner case where current sample does not have actions
-        if num_gts == 0:
-            cls_targets = gt_segment.new_full((num_pts, self.num_classes), 0)
-            reg_targets = gt_segment.new_zeros((num_pts, 2))
-            return cls_targets, reg_targets
-
-        # compute the lengths of all segments -> F T x N
-        lens = gt_segment[:, 1] - gt_segment[:, 0]
-        lens = lens[None, :].repeat(num_pts, 1)
-
-        # compute the distance of every point to each segment boundary
-        # auto broadcasting for all reg target-> F T x N x2
-        gt_segs = gt_segment[None].expand(num_pts, num_gts, 2)
-        left = concat_points[:, 0, None] - gt_segs[:, :, 0]
-        right = gt_segs[:, :, 1] - concat_points[:, 0, None]
-        reg_targets = torch.stack((left, right), dim=-1)
-
-        if self.train_center_sample == 'radius':
-            # center of all segments F T x N
-            center_pts = 0.5 * (gt_segs[:, :, 0] + gt_segs[:, :, 1])
-            # center sampling based on stride radius
-            # compute the new boundaries:
-            # concat_points[:, 3] stores the stride
-            t_mins = \
-                center_pts - concat_points[:, 3, None] * self.train_center_sample_radius
-            t_maxs = \
-                center_pts + concat_points[:, 3, None] * self.train_center_sample_radius
-            # prevent t_mins / maxs from over-running the action boundary
-            # left: torch.maximum(t_mins, gt_segs[:, :, 0])
-            # right: torch.minimum(t_maxs, gt_segs[:, :, 1])
-            # F T x N (distance to the new boundary)
-            cb_dist_left = concat_points[:, 0, None] \
-                           - torch.maximum(t_mins, gt_segs[:, :, 0])
-            cb_dist_right = torch.minimum(t_maxs, gt_segs[:, :, 1]) \
-                            - concat_points[:, 0, None]
-            # F T x N x 2
-            center_seg = torch.stack(
-                (cb_dist_left, cb_dist_right), -1)
-            # F T x N
-            inside_gt_seg_mask = center_seg.min(-1)[0] > 0
-        else:
-            # inside an gt action
-            inside_gt_seg_mask = reg_targets.min(-1)[0] > 0
-
-        # limit the regression range for each location
-        max_regress_distance = reg_targets.max(-1)[0]
-        # F T x N
-        inside_regress_range = torch.logical_and(
-            (max_regress_distance >= concat_points[:, 1, None]),
-            (max_regress_distance <= concat_points[:, 2, None])
+    def get_target_assigner(self):
+        """
+            A target assigner with the points of the training inputs (on cpu),
+            for targets assigned in the data loader workers
+        """
+        buffer_points = [pts[:self.max_seq_len // stride].cpu().clone()
+                         for pts, stride in zip(self.point_generator.buffer_points, self.fpn_strides)]
+        return TargetAssigner(
+            self.num_classes, self.train_center_sample, self.train_center_sample_radius,
+            fpn_strides=self.fpn_strides, buffer_points=buffer_points
         )
 
-        # if there are still more than one actions for one moment
-        # pick the one with the shortest duration (easiest to regress)
-        lens.masked_fill_(inside_gt_seg_mask==0, float('inf'))
-        lens.masked_fill_(inside_regress_range==0, float('inf'))
-        # F T x N -> F T
-        min_len, min_len_inds = lens.min(dim=1)
-
-        # corner case: multiple actions with very similar durations (e.g., THUMOS14)
-        min_len_mask = torch.logical_and(
-            (lens <= (min_len[:, None] + 1e-3)), (lens < float('inf'))
-        ).to(reg_targets.dtype)
-
-        # cls_targets: F T x C; reg_targets F T x 2
-        gt_label_one_hot = F.one_hot(
-            gt_label, self.num_classes
-        ).to(reg_targets.dtype)
-        cls_targets = min_len_mask @ gt_label_one_hot
-        # to prevent multiple GT actions with the same label and boundaries
-        cls_targets.clamp_(min=0.0, max=1.0)
-        # OK to use min_len_inds
-        reg_targets = reg_targets[range(num_pts), min_len_inds]
-        # normalization based on stride
-        reg_targets /= concat_points[:, 3, None]
-
-        return cls_targets, reg_targets
-
     def losses(
         self, fpn_masks,
         out_cls_logits, out_offsets,
         gt_cls_labels, gt_offsets
     ):
         # fpn_masks, out_*: F (List) [B, T_i, C]
-        # gt_* : B (list) [F T, C]
+        # gt_cls_labels : B (list) [K_i, 2] (point, class) pairs of the positives
+        # gt_offsets : B (list) [F T, 2]
         # fpn_masks -> (B, FT)
         valid_mask = torch.cat(fpn_masks, dim=1)
 
         # 1. classification loss
-        # stack the list -> (B, FT) -> (# Valid, )
-        gt_cls = torch.stack(gt_cls_labels)
-        pos_mask = torch.logical_and((gt_cls.sum(-1) > 0), valid_mask)
+        # cat the list -> (# Pos pairs, 3) (video, point, class), only valid points
+        gt_cls = torch.cat([
+            torch.cat((cls_targets.new_full((len(cls_targets), 1), vid_idx), cls_targets), dim=1)
+            for vid_idx, cls_targets in enumerate(gt_cls_labels)
+        ])
+        gt_cls = gt_cls[valid_mask[gt_cls[:, 0], gt_cls[:, 1]]]
+        # (B, FT)
+        pos_mask = torch.zeros_like(valid_mask)
+        pos_mask[gt_cls[:, 0], gt_cls[:, 1]] = True
 
         # cat the predicted offsets -> (B, FT, 2 (xC)) -> # (#Pos, 2 (xC))
         pred_offsets = torch.cat(out_offsets, dim=1)[pos_mask]
@@ -597,18 +709,20 @@ class PtTransformer(nn.Module):
             1 - self.loss_normalizer_momentum
         ) * max(num_pos, 1)
 
-        # gt_cls is already one hot encoded now, simply masking out
-        gt_target = gt_cls[valid_mask]
+        # row of each positive in the valid points (# Valid, C)
+        valid_rows = torch.cumsum(valid_mask.flatten(), 0).view_as(valid_mask) - 1
+        pos_inds = torch.stack((valid_rows[gt_cls[:, 0], gt_cls[:, 1]], gt_cls[:, 2]), dim=-1)
 
-        # optinal label smoothing
-        gt_target *= 1 - self.train_label_smoothing
-        gt_target += self.train_label_smoothing / (self.num_classes + 1)
+        # optinal label smoothing (of the one hot targets)
+        neg_target = self.train_label_smoothing / (self.num_classes + 1)
+        pos_target = (1 - self.train_label_smoothing) + neg_target
 
         # focal loss
-        cls_loss = sigmoid_focal_loss(
+        cls_loss = sparse_sigmoid_focal_loss(
             torch.cat(out_cls_logits, dim=1)[valid_mask],
-            gt_target,
-            reduction='sum'
+            pos_inds,
+            pos_target=pos_target,
+            neg_target=neg_target
         )
         cls_loss /= self.loss_normalizer
 
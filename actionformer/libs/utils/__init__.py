@@ -2,9 +2,10 @@ from .nms import batched_nms
 from .metrics import ANETdetection, remove_duplicate_annotations
 from .train_utils import (make_optimizer, make_scheduler, save_checkpoint,
                           AverageMeter, train_one_epoch, valid_one_epoch,
-                          fix_random_seed, ModelEma)
+                          fix_random_seed, ModelEma, DevicePrefetcher)
 from .postprocessing import postprocess_results
 
 __all__ = ['batched_nms', 'make_optimizer', 'make_scheduler', 'save_checkpoint',
            'AverageMeter', 'train_one_epoch', 'valid_one_epoch', 'ANETdetection',
-           'postprocess_results', 'fix_random_seed', 'ModelEma', 'remove_duplicate_annotations']
+           'postprocess_results', 'fix_random_seed', 'ModelEma', 'remove_duplicate_annotations',
+           'DevicePrefetcher']
@@ -72,6 +72,51 @@ def load_gt_seg_from_json(json_file, split=None, label='label_id', label_offset=
     return gt_base
 
 
+def load_gt_seg_from_npz(npz_file, split=None):
+    # load a columnar annotation file (see convert-annotations.py)
+    with np.load(npz_file) as data:
+        data = {key: data[key] for key in data.files}
+    subsets = dict(zip(data['videos'].tolist(), data['subset'].tolist()))
+
+    vids, starts, stops, labels = [], [], [], []
+    # annotations are grouped by video
+    video_ids = data['video_id']
+    bounds = np.flatnonzero(video_ids[1:] != video_ids[:-1]) + 1
+    # no annotations -> no groups (not a single empty one)
+    group_starts = np.r_[0, bounds] if len(video_ids) > 0 else []
+    for st, ed in zip(group_starts, np.r_[bounds, len(video_ids)]):
+        # filter based on split
+        if (split is not None) and subsets[video_ids[st]].lower() != split:
+            continue
+        # remove duplicated instances
+        ants = [{'segment': [s, e], 'label_id': l} for s, e, l in zip(
+            data['start'][st:ed].tolist(), data['stop'][st:ed].tolist(),
+            data['label'][st:ed].tolist())]
+        ants = remove_duplicate_annotations(ants)
+        vids += [str(video_ids[st])] * len(ants)
+        starts += [event['segment'][0] for event in ants]
+        stops += [event['segment'][1] for event in ants]
+        labels += [event['label_id'] for event in ants]
+
+    # move to pd dataframe
+    gt_base = pd.DataFrame({
+        'video-id' : vids,
+        't-start' : starts,
+        't-end': stops,
+        'label': labels
+    })
+
+    return gt_base
+
+
+def load_gt_seg(ant_file, split=None, label='label_id', label_offset=0):
+    if ant_file.endswith('.npz'):
+        # columnar annotations (labels are already label ids)
+        return load_gt_seg_from_npz(ant_file, split=split)
+    return load_gt_seg_from_json(
+        ant_file, split=split, label=label, label_offset=label_offset)
+
+
 def load_pred_seg_from_json(json_file, label='label_id', label_offset=0):
     # load json file
     with open(json_file, "r", encoding="utf8") as f:
@@ -130,13 +175,25 @@ class ANETdetection(object):
         self.num_workers = num_workers
         if dataset_name is not None:
             self.dataset_name = dataset_name
+        elif isinstance(ant_file, (list, tuple)):
+            self.dataset_name = 'union'
         else:
-            self.dataset_name = os.path.basename(ant_file).replace('.json', '')
+            self.dataset_name = os.path.splitext(os.path.basename(ant_file))[0]
 
         # Import ground truth and predictions
         self.split = split
-        self.ground_truth = load_gt_seg_from_json(
-            ant_file, split=self.split, label=label, label_offset=label_offset)
+        if isinstance(ant_file, (list, tuple)):
+            # union of several sources, each with its own subsets and video id prefix
+            # (see libs/datasets/union.py), split is not used
+            ground_truth = []
+            for source in ant_file:
+                for subset in source['split']:
+                    gt_base = load_gt_seg(source['json_file'], subset, label, label_offset)
+                    gt_base['video-id'] = source['prefix'] + gt_base['video-id']
+                    ground_truth.append(gt_base)
+            self.ground_truth = pd.concat(ground_truth, ignore_index=True)
+        else:
+            self.ground_truth = load_gt_seg(ant_file, self.split, label, label_offset)
 
         # remove labels that does not exists in gt
         self.activity_index = {j: i for i, j in enumerate(sorted(self.ground_truth['label'].unique()))}
@@ -246,6 +246,63 @@ class ModelEma(torch.nn.Module):
         self._update(model, update_fn=lambda e, m: m)
 
 
+def _map_tensors(obj, fn):
+    # apply fn to all the tensors of a (nested) batch of dicts / lists / tuples
+    if torch.is_tensor(obj):
+        return fn(obj)
+    if isinstance(obj, dict):
+        return {k: _map_tensors(v, fn) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_map_tensors(v, fn) for v in obj)
+    return obj
+
+
+class DevicePrefetcher(object):
+    """
+        Wraps a data loader: the next batch is copied to the device (pinned,
+        non-blocking, on a side stream) while the current batch is being used.
+        On a CPU device, batches are returned as they are.
+        data_time: time spent waiting for the loader in the current epoch (sec)
+    """
+    def __init__(self, loader, device):
+        self.loader = loader
+        self.device = torch.device(device)
+        self.stream = None
+        if self.device.type == 'cuda':
+            self.stream = torch.cuda.Stream(self.device)
+        self.data_time = 0.0
+
+    def __len__(self):
+        return len(self.loader)
+
+    def _preload(self, loader_iter):
+        # fetch the next batch and start its copy, None at the end of the loader
+        start = time.time()
+        batch = next(loader_iter, None)
+        self.data_time += time.time() - start
+        if batch is None or self.stream is None:
+            return batch
+        with torch.cuda.stream(self.stream):
+            batch = _map_tensors(batch, lambda x: (
+                x if x.is_pinned() else x.pin_memory()).to(self.device, non_blocking=True))
+        return batch
+
+    def __iter__(self):
+        self.data_time = 0.0
+        loader_iter = iter(self.loader)
+        next_batch = self._preload(loader_iter)
+        while next_batch is not None:
+            batch = next_batch
+            if self.stream is not None:
+                # wait for the copy, and keep its memory until used on this stream
+                current_stream = torch.cuda.current_stream(self.device)
+                current_stream.wait_stream(self.stream)
+                _map_tensors(batch, lambda x: x.record_stream(current_stream))
+            # the copy of the next batch overlaps with the compute of this one
+            next_batch = self._preload(loader_iter)
+            yield batch
+
+
 ################################################################################
 def train_one_epoch(
     train_loader,
@@ -261,15 +318,20 @@ def train_one_epoch(
     """Training the model for one epoch"""
     # set up meters
     batch_time = AverageMeter()
+    data_time = AverageMeter()
     losses_tracker = {}
     # number of iterations per epoch
     num_iters = len(train_loader)
     # switch to train mode
     model.train()
+    # batches are copied to the device of the model one batch ahead
+    device = next(model.parameters()).device
+    train_loader = DevicePrefetcher(train_loader, device)
 
     # main training loop
     print("\n[Train]: Epoch {:d} started".format(curr_epoch))
     start = time.time()
+    last_data_time = 0.0
     for iter_idx, video_list in enumerate(train_loader, 0):
         # zero out optim
         optimizer.zero_grad(set_to_none=True)
@@ -292,9 +354,13 @@ def train_one_epoch(
         # printing (only check the stats when necessary to avoid extra cost)
         if (iter_idx != 0) and (iter_idx % print_freq) == 0:
             # measure elapsed time (sync all kernels)
-            torch.cuda.synchronize()
+            if device.type == 'cuda':
+                torch.cuda.synchronize()
             batch_time.update((time.time() - start) / print_freq)
             start = time.time()
+            # time spent waiting for data
+            data_time.update((train_loader.data_time - last_data_time) / print_freq)
+            last_data_time = train_loader.data_time
 
             # track all losses
             for key, value in losses.items():
@@ -330,13 +396,19 @@ def train_one_epoch(
                     losses_tracker['final_loss'].val,
                     global_step
                 )
+                # time waiting for data
+                tb_writer.add_scalar(
+                    'train/data_time',
+                    data_time.val,
+                    global_step
+                )
 
             # print to terminal
             block1 = 'Epoch: [{:03d}][{:05d}/{:05d}]'.format(
                 curr_epoch, iter_idx, num_iters
             )
-            block2 = 'Time {:.2f} ({:.2f})'.format(
-                batch_time.val, batch_time.avg
+            block2 = 'Time {:.2f} ({:.2f}) Data {:.2f} ({:.2f})'.format(
+                batch_time.val, batch_time.avg, data_time.val, data_time.avg
             )
             block3 = 'Loss {:.2f} ({:.2f})\n'.format(
                 losses_tracker['final_loss'].val,
@@ -352,6 +424,8 @@ def train_one_epoch(
             print('\t'.join([block1, block2, block3, block4]))
 
     # finish up and print
+    print("[Train]: Epoch {:d} waited {:.2f} sec for data".format(
+        curr_epoch, train_loader.data_time))
     lr = scheduler.get_last_lr()[0]
     print("[Train]: Epoch {:d} finished with lr={:.8f}\n".format(curr_epoch, lr))
     return
@@ -407,7 +481,8 @@ def valid_one_epoch(
         # printing
         if (iter_idx != 0) and iter_idx % (print_freq) == 0:
             # measure elapsed time (sync all kernels)
-            torch.cuda.synchronize()
+            if torch.cuda.is_available():
+                torch.cuda.synchronize()
             batch_time.update((time.time() - start) / print_freq)
             start = time.time()
 
@@ -0,0 +1,219 @@
+# python imports
+import argparse
+import os
+import json
+import time
+from pprint import pprint
+
+# numpy / torch imports
+import yaml
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.utils.data
+
+# our code
+from libs.core import load_config
+from libs.datasets import make_dataset, make_data_loader
+from libs.modeling import make_meta_arch
+from libs.utils import make_optimizer, fix_random_seed
+from compare_feats import folder_size
+
+
+################################################################################
+def get_video_ids(cfg, split):
+    """ids of the videos in a split (one entry per video)"""
+    dataset = make_dataset(
+        cfg['dataset_name'], False, split, **cfg['dataset']
+    )
+    assert hasattr(dataset, 'feat_store'), "Dataset must use a feature store."
+    return dataset.feat_store, [item['id'] for item in dataset.data_list]
+
+def fit_pca(feat_store, video_ids, dim):
+    """PCA from the running sums of x and x^T x over all the frames (T x C)"""
+    num_feats, feat_sum, feat_cov = 0, None, None
+    for video_id in video_ids:
+        feats = np.asarray(feat_store.open(video_id), dtype=np.float64)
+        if feat_sum is None:
+            feat_sum = np.zeros(feats.shape[1], dtype=np.float64)
+            feat_cov = np.zeros((feats.shape[1], feats.shape[1]), dtype=np.float64)
+        num_feats += feats.shape[0]
+        feat_sum += feats.sum(axis=0)
+        feat_cov += feats.T @ feats
+    mean = feat_sum / num_feats
+    feat_cov = feat_cov / num_feats - np.outer(mean, mean)
+    # eigenvalues in ascending order -> keep the top dim components
+    eig_vals, eig_vecs = np.linalg.eigh(feat_cov)
+    eig_vals, eig_vecs = eig_vals[::-1], eig_vecs[:, ::-1]
+    components = eig_vecs[:, :dim].T
+    explained = float(eig_vals[:dim].sum() / max(eig_vals.sum(), 1e-12))
+    return mean.astype(np.float32), components.astype(np.float32), explained
+
+def fit_random(source_dim, dim, seed):
+    """Gaussian random projection (scaled to preserve the norms on average)"""
+    rng = np.random.RandomState(seed)
+    components = rng.normal(size=(dim, source_dim)) / np.sqrt(dim)
+    mean = np.zeros(source_dim)
+    return mean.astype(np.float32), components.astype(np.float32)
+
+def reduce_feats(feat_store, video_ids, mean, components, output_folder):
+    """write (x - mean) @ components^T for each video (T x dim, .npz)"""
+    for video_id in video_ids:
+        feats = np.asarray(feat_store.open(video_id), dtype=np.float32)
+        feats = (feats - mean) @ components.T
+        np.savez_compressed(
+            os.path.join(output_folder, feat_store.file_prefix + video_id + '.npz'),
+            feats=feats.astype(np.float32)
+        )
+        print("Reduced {:s} ({:d} x {:d} -> {:d})".format(
+            video_id, feats.shape[0], components.shape[1], components.shape[0]))
+
+def benchmark_train(cfg, num_iters):
+    """time num_iters training iterations (data loading + forward / backward)"""
+    _ = fix_random_seed(cfg['init_rand_seed'], include_cuda=True)
+    train_dataset = make_dataset(
+        cfg['dataset_name'], True, cfg['train_split'], **cfg['dataset']
+    )
+    cfg['model']['train_cfg']['head_empty_cls'] = \
+        train_dataset.get_attributes()['empty_label_ids']
+    model = make_meta_arch(cfg['model_name'], **cfg['model'])
+    train_loader = make_data_loader(
+        train_dataset, True, None, **cfg['loader'],
+        batch_padding=model.get_batch_padding(),
+        target_assigner=model.get_target_assigner())
+    model = nn.DataParallel(model, device_ids=cfg['devices'])
+    optimizer = make_optimizer(model, cfg['opt'])
+    model.train()
+
+    # the first iteration (worker start up, cudnn autotuning) is not timed
+    num_done, start = 0, None
+    while num_done < num_iters + 1:
+        for video_list in train_loader:
+            if num_done == 1:
+                if torch.cuda.is_available():
+                    torch.cuda.synchronize()
+                start = time.time()
+            optimizer.zero_grad(set_to_none=True)
+            losses = model(video_list)
+            losses['final_loss'].backward()
+            optimizer.step()
+            num_done += 1
+            if num_done == num_iters + 1:
+                break
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return num_iters / (time.time() - start)
+
+def write_reduced_config(config_file, output_folder):
+    """copy of a config file using the reduced feats (the input dim comes from projection.json)"""
+    with open(config_file, 'r') as fid:
+        config = yaml.load(fid, Loader=yaml.FullLoader)
+    config['dataset']['feat_folder'] = output_folder
+    config['dataset']['feat_backend'] = 'npz'
+    config['dataset']['file_ext'] = '.npz'
+    config['dataset'].pop('input_dim', None)
+    reduced_config_file = os.path.join(output_folder, 'config.yaml')
+    with open(reduced_config_file, 'w') as fid:
+        yaml.dump(config, fid, sort_keys=False)
+    return reduced_config_file
+
+def main(args):
+    """fit a projection on the training split and write the reduced feats"""
+    if os.path.isfile(args.config):
+        cfg = load_config(args.config)
+    else:
+        raise ValueError("Config file does not exist.")
+    pprint(cfg)
+
+    # reduced feats are written next to the original ones
+    feat_folder = os.path.normpath(cfg['dataset']['feat_folder'])
+    output_folder = args.output
+    if len(output_folder) == 0:
+        output_folder = feat_folder + '_{:s}{:d}'.format(args.method, args.dim)
+    os.makedirs(output_folder, exist_ok=True)
+
+    # fit on the training split only
+    feat_store, train_ids = get_video_ids(cfg, cfg['train_split'])
+    source_dim = cfg['dataset']['input_dim']
+    assert args.dim < source_dim, "Output dim must be smaller than the input dim."
+    meta = {
+        'method': args.method,
+        'source_folder': feat_folder,
+        'source_dim': source_dim,
+        'output_dim': args.dim,
+        'fit_split': list(cfg['train_split']),
+    }
+    print("\nFitting {:s} projection ({:d} -> {:d}) on {:d} videos ...".format(
+        args.method, source_dim, args.dim, len(train_ids)))
+    if args.method == 'pca':
+        mean, components, explained = fit_pca(feat_store, train_ids, args.dim)
+        meta['explained_variance'] = explained
+        print("Explained variance: {:.2f} (%)".format(explained * 100))
+    else:
+        mean, components = fit_random(source_dim, args.dim, args.seed)
+        meta['seed'] = args.seed
+
+    # apply to all the splits of the config
+    _, val_ids = get_video_ids(cfg, cfg['val_split'])
+    video_ids = list(dict.fromkeys(train_ids + val_ids))
+    reduce_feats(feat_store, video_ids, mean, components, output_folder)
+    np.savez(os.path.join(output_folder, 'projection.npz'),
+             mean=mean, components=components)
+    # input_dim of configs using these feats is read from this file
+    with open(os.path.join(output_folder, 'projection.json'), 'w') as fid:
+        json.dump(meta, fid, indent=2)
+    reduced_config_file = write_reduced_config(args.config, output_folder)
+
+    block = '[RESULTS] full vs reduced feats'
+    block += '\nFeats on disk: {:.2f} vs {:.2f} GB'.format(
+        folder_size(feat_folder) / 1024 ** 3, folder_size(output_folder) / 1024 ** 3)
+
+    if args.benchmark > 0:
+        # same config, only the feats (and the input dim) differ
+        reduced_cfg = load_config(reduced_config_file)
+        print("\nBenchmarking full feats ...")
+        full_speed = benchmark_train(cfg, args.benchmark)
+        print("\nBenchmarking reduced feats ...")
+        reduced_speed = benchmark_train(reduced_cfg, args.benchmark)
+        block += '\nTrain throughput: {:.2f} vs {:.2f} iters/sec ({:.2f}x)'.format(
+            full_speed, reduced_speed, reduced_speed / full_speed)
+    print(block)
+    print("Reduced feats saved to {:s}".format(output_folder))
+    # the mAP needs a model trained on the reduced feats
+    print("mAP against the full feats:\n"
+          "  python train.py {:s}\n"
+          "  python compare_feats.py {:s} <full feats ckpt> {:s} --test-ckpt <reduced feats ckpt>".format(
+              reduced_config_file, args.config, output_folder))
+    return
+
+################################################################################
+if __name__ == '__main__':
+    """Entry Point"""
+    # the arg parser
+    parser = argparse.ArgumentParser(
+      description='Reduce the input feats with a PCA / random projection fitted on the training split',
+      formatter_class=argparse.RawDescriptionHelpFormatter,
+      epilog='The reduced feats are written with a projection.json and a config.yaml (the\n'
+             'input config using the reduced feats). --benchmark only times training, the\n'
+             'mAP against the full feats needs a model trained on each of them:\n'
+             '  1. python reduce_feats.py <config> [--benchmark N]\n'
+             '  2. python train.py <output folder>/config.yaml\n'
+             '  3. python compare_feats.py <config> <full feats ckpt> <output folder> \\\n'
+             '       --test-ckpt <reduced feats ckpt>\n'
+             'where <full feats ckpt> is a model trained with <config>, and <reduced feats\n'
+             'ckpt> the one of step 2. Step 3 reports the mAP at each tIoU of both runs.')
+    parser.add_argument('config', metavar='DIR',
+                        help='path to a config file (full feats)')
+    parser.add_argument('--method', default='pca', choices=['pca', 'random'],
+                        help='projection method (default: pca)')
+    parser.add_argument('--dim', default=512, type=int,
+                        help='dim of the reduced feats (default: 512)')
+    parser.add_argument('--output', default='', type=str,
+                        help='output folder (default: <feat_folder>_<method><dim>)')
+    parser.add_argument('--seed', default=0, type=int,
+                        help='seed of the random projection (default: 0)')
+    parser.add_argument('--benchmark', default=0, type=int,
+                        help='number of training iterations to time for the full '
+                             'and reduced feats (default: 0, no benchmark)')
+    args = parser.parse_args()
+    main(args)
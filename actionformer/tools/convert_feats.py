@@ -0,0 +1,158 @@
+import os
+import json
+import shutil
+import argparse
+
+import numpy as np
+
+"""
+Convert per-video features (T x C, .npz with a 'feats' key or .npy) into the
+storage formats supported by libs/datasets/feat_stores.py
+
+mmap: one uncompressed, channel first (C x T) .npy file per video,
+      to be used with feat_backend: mmap
+pack: all videos packed (T x C) into a few large shard files plus an index.json
+      with (shard, byte offset, T, C, dtype) for each video,
+      to be used with feat_backend: pack (feat_folder is the output folder)
+
+Both formats accept --dtype float32 | float16 | int8. int8 feats are quantized
+per channel with a scale and a zero point (x = (q - zero_point) * scale), saved
+as a 2 x C float32 array next to the feats (<video_id>.qparams.npy for mmap,
+inside the shard for pack), and are dequantized on load by the feat store.
+
+python ./tools/convert_feats.py <input folder> <output folder> --format mmap
+python ./tools/convert_feats.py <input folder> <output folder> --format pack --shard-size 4
+python ./tools/convert_feats.py <input folder> <output folder> --format mmap --dtype int8
+"""
+
+# byte alignment of each video inside a shard
+PACK_ALIGN = 64
+
+
+def load_video_feats(filename):
+    # T x C
+    if filename.endswith('.npz'):
+        with np.load(filename) as data:
+            return data['feats']
+    return np.load(filename)
+
+
+def quantize_feats(feats):
+    # per channel (C) asymmetric int8 quantization of T x C feats
+    feats = feats.astype(np.float32)
+    f_min, f_max = feats.min(axis=0), feats.max(axis=0)
+    scale = (f_max - f_min) / 255.0
+    scale[scale == 0] = 1.0
+    zero_point = np.round(-128.0 - f_min / scale)
+    qfeats = np.clip(np.round(feats / scale + zero_point), -128, 127).astype(np.int8)
+    qparams = np.stack((scale, zero_point)).astype(np.float32)
+    return qfeats, qparams
+
+
+def cast_feats(feats, dtype):
+    # returns the feats to store and their qparams (None if not quantized)
+    if dtype == 'int8':
+        return quantize_feats(feats)
+    return feats.astype(dtype), None
+
+
+def list_videos(feat_folder, file_ext):
+    # video id -> feature file
+    videos = {}
+    for f in sorted(os.listdir(feat_folder)):
+        # skip the projection of reduced feats (see reduce_feats.py)
+        if f.endswith(file_ext) and not f.startswith('projection.'):
+            videos[f[:-len(file_ext)]] = os.path.join(feat_folder, f)
+    return videos
+
+
+def convert_mmap(videos, out_folder, dtype):
+    for video_id, filename in videos.items():
+        feats, qparams = cast_feats(load_video_feats(filename), dtype)
+        if qparams is not None:
+            np.save(os.path.join(out_folder, video_id + '.qparams.npy'), qparams)
+        # C x T on disk, so a temporal window is a strided read of C rows
+        out = np.lib.format.open_memmap(
+            os.path.join(out_folder, video_id + '.npy'),
+            mode='w+', dtype=feats.dtype, shape=feats.shape[::-1]
+        )
+        out[:] = feats.T
+        out.flush()
+        del out
+        print("Converted {:s} ({:d} x {:d})".format(video_id, *feats.shape))
+
+
+def convert_pack(videos, out_folder, shard_size, dtype):
+    # shard_size in GB
+    max_shard_bytes = int(shard_size * (1024 ** 3))
+    index = {'shards': [], 'videos': {}}
+    shard_fid, shard_bytes = None, 0
+
+    for video_id, filename in videos.items():
+        feats, qparams = cast_feats(load_video_feats(filename), dtype)
+        feats = np.ascontiguousarray(feats)
+        data = feats.tobytes()
+        if qparams is not None:
+            data += qparams.tobytes()
+        # open a new shard if needed (a video is never split across shards)
+        if shard_fid is None or (
+            shard_bytes > 0 and shard_bytes + len(data) > max_shard_bytes
+        ):
+            if shard_fid is not None:
+                shard_fid.close()
+            shard_name = 'feats_{:03d}.bin'.format(len(index['shards']))
+            index['shards'].append(shard_name)
+            shard_fid = open(os.path.join(out_folder, shard_name), 'wb')
+            shard_bytes = 0
+
+        # write T x C (+ qparams), record (shard, offset, T, C, dtype[, qparams offset])
+        index['videos'][video_id] = [
+            len(index['shards']) - 1, shard_bytes,
+            feats.shape[0], feats.shape[1], feats.dtype.str
+        ]
+        if qparams is not None:
+            index['videos'][video_id].append(shard_bytes + feats.nbytes)
+        shard_fid.write(data)
+        shard_bytes += len(data)
+        # pad to the next aligned offset
+        padding = (-shard_bytes) % PACK_ALIGN
+        shard_fid.write(b'\0' * padding)
+        shard_bytes += padding
+        print("Packed {:s} ({:d} x {:d}) into {:s}".format(
+            video_id, feats.shape[0], feats.shape[1], index['shards'][-1]))
+
+    if shard_fid is not None:
+        shard_fid.close()
+    with open(os.path.join(out_folder, 'index.json'), 'w') as fid:
+        json.dump(index, fid)
+
+
+################################################################################
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Convert per-video features into another feature store format')
+    parser.add_argument('input', type=str, metavar='DIR',
+                        help='folder with the input features (T x C)')
+    parser.add_argument('output', type=str, metavar='DIR',
+                        help='output folder')
+    parser.add_argument('--format', default='mmap', choices=['mmap', 'pack'],
+                        help='output format (default: mmap)')
+    parser.add_argument('--shard-size', default=4.0, type=float,
+                        help='max size of each shard in GB for pack (default: 4)')
+    parser.add_argument('--dtype', default='float32',
+                        choices=['float32', 'float16', 'int8'],
+                        help='storage type of the feats (default: float32)')
+    parser.add_argument('--ext', default='.npz', type=str,
+                        help='extension of the input files (default: .npz)')
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    videos = list_videos(args.input, args.ext)
+    # keep the projection info of reduced feats (sets the input dim of the model)
+    for meta_file in ['projection.json', 'projection.npz']:
+        if os.path.isfile(os.path.join(args.input, meta_file)):
+            shutil.copy(os.path.join(args.input, meta_file), args.output)
+    if args.format == 'mmap':
+        convert_mmap(videos, args.output, args.dtype)
+    elif args.format == 'pack':
+        convert_pack(videos, args.output, args.shard_size, args.dtype)
@@ -14,7 +14,7 @@ from torch.utils.tensorboard import SummaryWriter
 
 # our code
 from libs.core import load_config
-from libs.datasets import make_dataset, make_data_loader
+from libs.datasets import make_dataset, make_data_loader, get_feat_caches
 from libs.modeling import make_meta_arch
 from libs.utils import (train_one_epoch, valid_one_epoch, ANETdetection,
                         save_checkpoint, make_optimizer, make_scheduler,
@@ -65,13 +65,14 @@ def main(args):
     train_db_vars = train_dataset.get_attributes()
     cfg['model']['train_cfg']['head_empty_cls'] = train_db_vars['empty_label_ids']
 
-    # data loaders
-    train_loader = make_data_loader(
-        train_dataset, True, rng_generator, **cfg['loader'])
-
     """3. create model, optimizer, and scheduler"""
     # model
     model = make_meta_arch(cfg['model_name'], **cfg['model'])
+    # data loaders (batches may be padded by the workers, as the model does)
+    train_loader = make_data_loader(
+        train_dataset, True, rng_generator, **cfg['loader'],
+        batch_padding=model.get_batch_padding(),
+        target_assigner=model.get_target_assigner())
     # not ideal for multi GPU training, ok for now
     model = nn.DataParallel(model, device_ids=cfg['devices'])
     # optimizer
@@ -132,6 +133,10 @@ def main(args):
             tb_writer=tb_writer,
             print_freq=args.print_freq
         )
+        # shared feature cache (if enabled)
+        for feat_cache in get_feat_caches(train_dataset):
+            print("Feature cache: {hits:d} hits, {misses:d} misses, "
+                  "{num_videos:d} videos ({size_gb:.2f} GB)".format(**feat_cache.get_stats()))
 
         # save ckpt once in a while
         if (
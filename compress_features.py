@@ -4,56 +4,127 @@
 # individual clip and compresses it to a single file, saved with the original videos name + '.npz' to the
 # 'output_folder' path.
 
-# Execute with: python compress_features.py <clip feature folder> <output folder>
+# Execute with: python compress_features.py <clip feature folder> <output folder> [--workers <number of processes>]
+#   [--npy]
 
+# The clips of a video are counted before loading them, and each clip is written in its row of a preallocated array,
+# so the cost of compressing a video is linear in its number of clips. Videos are processed in parallel by a pool of
+# worker processes. With --npy, the features are written to an uncompressed, memory-mapped '.npy' file instead, so the
+# whole video never has to be kept in memory.
+
+import argparse
 import os
-import sys
 from glob import glob
+from multiprocessing import Pool
 
 import numpy as np
 from tqdm import tqdm
 
+# Feature dimension of the (empty) array written for a video without clips
+EMPTY_FEAT_DIM = 2304
+
+
+# Loads the features of a single clip as a flat row
+def load_clip(clip_path):
+    with np.load(clip_path) as clip:
+        return np.asarray(clip['arr_0'], dtype=np.float32).flatten()
+
+
+# Returns the clip paths of a video folder, sorted by numerical order
+def list_clips(video_folder):
+    clip_list = map(os.path.basename, glob(video_folder + '/*.npz'))
+    clip_list = sorted(clip_list, key=lambda x: int(x.split('.')[0]))
+    return [video_folder + '/' + clip_name for clip_name in clip_list]
+
+
+# Returns the original name of the video from its clip folder (e.g. P01_1_clips -> P01_1)
+def get_video_id(video_folder):
+    return '_'.join(os.path.basename(video_folder).split('_')[0:2])
+
+
+# Concatenates the features of all the clips of a video and saves them with the video id in the output folder
+# Returns the video id and the number of clips
+def compress_video(video_folder, output_folder, use_npy=False, show_progress=True):
+    video_id = get_video_id(video_folder)
+    clip_paths = list_clips(video_folder)
+
+    # A video without clips still gets an empty array, marking the video as present
+    if len(clip_paths) == 0:
+        array = np.empty((0, EMPTY_FEAT_DIM), dtype=np.float32)
+        if use_npy:
+            np.save(output_folder + '/' + video_id + '.npy', array)
+        else:
+            np.savez_compressed(output_folder + '/' + video_id + '.npz', feats=array)
+        return video_id, 0
+
+    # The first clip gives us the feature dimension, the number of clips the number of rows
+    first_row = load_clip(clip_paths[0])
+    shape = (len(clip_paths), first_row.shape[0])
+    if use_npy:
+        array = np.lib.format.open_memmap(output_folder + '/' + video_id + '.npy', mode='w+', dtype=np.float32,
+                                          shape=shape)
+    else:
+        array = np.empty(shape, dtype=np.float32)
+    array[0] = first_row
+
+    # Write each clip in its row
+    for row, clip_path in enumerate(tqdm(clip_paths[1:], leave=False, disable=not show_progress), start=1):
+        array[row] = load_clip(clip_path)
+
+    # Save the compressed feature array to the output folder using the video id
+    if use_npy:
+        array.flush()
+        del array
+    else:
+        np.savez_compressed(output_folder + '/' + video_id + '.npz', feats=array)
+
+    return video_id, shape[0]
+
+
+# Worker entry point for the process pool
+def compress_video_worker(args):
+    video_folder, output_folder, use_npy = args
+    return compress_video(video_folder, output_folder, use_npy, show_progress=False)
+
 
 # Processes all the clip folders inside of feature_folder. For each one of them, we extract all the clips' features,
 # concatenate them in a single numpy array and save it with the original video's name (.npz) in the output_folder
-def compress_features(feature_folder, output_folder):
+def compress_features(feature_folder, output_folder, num_workers=1, use_npy=False):
     # If the output_folder does not exist, we create it
     if not os.path.exists(output_folder):
         os.mkdir(output_folder)
 
-    # For each video folder inside the feature folder
-    for video_folder, _, _ in os.walk(feature_folder):
-        if video_folder == feature_folder:
-            continue
-
-        # Get the original name of the video
-        video_id = '_'.join(os.path.basename(video_folder).split('_')[0:2])
-        print('Compressing ', video_id, '\'s features...', sep='')
+    # Every video folder inside the feature folder
+    video_folders = sorted(folder for folder, _, _ in os.walk(feature_folder) if folder != feature_folder)
 
-        # Read all the clips, sort them by numerical order
-        clip_list = map(os.path.basename, glob(video_folder + '/*.npz'))
-        clip_list = sorted(clip_list, key=lambda x: int(x.split('.')[0]))
-        bar = tqdm(range(len(clip_list)), leave=False)
-
-        # Empty array
-        array = np.empty((0, 2304), dtype=np.float32)
-
-        # For each clip, we concatenate it in the array
-        for clip_name in clip_list:
-            # Load clip
-            row = np.asarray(np.load(video_folder + '/' + clip_name)['arr_0'])
-            row = row.flatten()
-
-            # Concatenate
-            array = np.vstack([array, row])
-
-            bar.update(1)
-            bar.refresh()
-
-        # Save the compressed feature array to the output folder using the video id
-        print('\nDone\n')
-        np.savez_compressed(output_folder + '/' + video_id + '.npz', feats=array)
+    if num_workers <= 1:
+        for video_folder in video_folders:
+            print('Compressing ', get_video_id(video_folder), '\'s features...', sep='')
+            compress_video(video_folder, output_folder, use_npy)
+            print('\nDone\n')
+    else:
+        with Pool(num_workers) as pool:
+            tasks = [(video_folder, output_folder, use_npy) for video_folder in video_folders]
+            for video_id, num_clips in tqdm(pool.imap_unordered(compress_video_worker, tasks),
+                                            total=len(tasks)):
+                tqdm.write('Compressed ' + video_id + ' (' + str(num_clips) + ' clips)')
 
 
 if __name__ == "__main__":
-    compress_features(sys.argv[1], sys.argv[2])
+    # Create the argument parser
+    parser = argparse.ArgumentParser(
+        prog='compress_features.py',
+        description='Takes all the clip feature folders inside the feature folder and concatenates the features of '
+                    'each video into a single file, saved with the original video\'s name to the output folder.'
+    )
+
+    # Define the arguments needed
+    parser.add_argument('FeatureFolder', help="Folder with the clip feature folders of each video")
+    parser.add_argument('OutputFolder', help="Folder where the video features will be saved")
+    parser.add_argument('--workers', type=int, default=1, help="Number of videos compressed in parallel")
+    parser.add_argument('--npy', action='store_true', default=argparse.SUPPRESS,
+                        help="Save uncompressed, memory-mapped .npy files instead of .npz files")
+
+    # Parse the arguments
+    args = parser.parse_args()
+    compress_features(args.FeatureFolder, args.OutputFolder, args.workers, "npy" in args)
@@ -1,38 +1,118 @@
 # Guillermo Enguita Lahoz 801618
 # The script takes as input a folder path, and will compress any .npy files in that folder to the .npz format
-# Execute with: python compress_numpy.py <path to folder>
+# Execute with: python compress_numpy.py <path to folder> [--output <output folder>] [--workers <number of processes>]
+#   [--verify] [--force]
 
-import sys
+# Each file is compressed once, directly under the 'feats' key, to a temporary file that is renamed when complete, so an
+# interrupted run never leaves a broken .npz behind. Files are compressed in parallel by a pool of worker processes.
+# Files whose .npz is newer than the .npy are skipped, unless --force is set. With --verify, every written file is read
+# back and its checksum compared with the one of the input array.
+
+import argparse
+import hashlib
 import os
+from multiprocessing import Pool
+
 import numpy as np
+from tqdm import tqdm
+
+
+# Returns the name of the compressed file, removing the '_32' suffix given by SlowFast (if present)
+def get_output_name(file):
+    basename = os.path.splitext(file)[0]
+    basename_splits = basename.split(sep='_')
+    basename_splits = basename_splits[0:len(basename_splits)-1]
+    if len(basename_splits) == 2:
+        basename = '_'.join(basename_splits)
+    return basename + '.npz'
+
+
+# Checksum of an array, covering its type and shape as well as its values
+def array_checksum(array):
+    array = np.ascontiguousarray(array)
+    checksum = hashlib.sha256()
+    checksum.update(array.dtype.str.encode())
+    checksum.update(str(array.shape).encode())
+    checksum.update(array.tobytes())
+    return checksum.hexdigest()
+
+
+# Checks if the compressed file exists and is newer than its .npy file
+def is_up_to_date(npy_path, npz_path):
+    return os.path.exists(npz_path) and os.path.getmtime(npz_path) >= os.path.getmtime(npy_path)
+
+
+# Compresses a single .npy file to npz_path, under the 'feats' key
+# Returns the file name and its status ('compressed', 'skipped' or 'verified')
+def compress_file(npy_path, npz_path, verify=False, force=False):
+    file = os.path.basename(npy_path)
+    if not force and is_up_to_date(npy_path, npz_path):
+        return file, 'skipped'
+
+    # Write to a temporary file (np.savez_compressed needs the .npz extension) and rename it once complete
+    array = np.load(npy_path)
+    tmp_path = npz_path[:-len('.npz')] + '.tmp.npz'
+    np.savez_compressed(tmp_path, feats=array)
+
+    if verify:
+        with np.load(tmp_path) as data:
+            if array_checksum(data['feats']) != array_checksum(array):
+                os.remove(tmp_path)
+                raise ValueError('Checksum mismatch when compressing ' + npy_path)
+    os.replace(tmp_path, npz_path)
+    return file, 'verified' if verify else 'compressed'
+
+
+# Worker entry point for the process pool
+def compress_file_worker(args):
+    return compress_file(*args)
 
 
 # Takes all the npy files from a given folder and compresses them to the npz format
-def compress_npy(npy_folder):
-    # For all files in the folder
-    for file in os.listdir(npy_folder):
-        # Check if they are on .npy format
-        if file.endswith('.npy'):
-            # Load the file and compress as .npz
-            print('Compressing ', file, '...', end='', sep='')
-            array = np.load(npy_folder + '/' + file)
-            basename = os.path.splitext(file)[0]
-
-            # Remove the '_32' suffix given by SlowFast (if present)
-            basename_splits = basename.split(sep='_')
-            basename_splits = basename_splits[0:len(basename_splits)-1]
-            if len(basename_splits) == 2:
-                basename = '_'.join(basename_splits)
-
-            np.savez_compressed(npy_folder + '/' + basename + '.npz', array)
-
-            # TODO check if this is necessary
-            # Cannot save directly with 'feats' as key without getting a bad zip file error
-            # Reopen the file, and save it correctly
-            array = np.load(npy_folder + '/' + basename + '.npz')
-            np.savez_compressed(npy_folder + '/' + basename + '.npz', feats=array['arr_0'])
-            print(' Done!')
+# The compressed files are saved to output_folder (the same folder by default), num_workers files at a time
+def compress_npy(npy_folder, output_folder=None, num_workers=1, verify=False, force=False):
+    if output_folder is None:
+        output_folder = npy_folder
+    if not os.path.exists(output_folder):
+        os.mkdir(output_folder)
+
+    # For all the .npy files in the folder
+    tasks = [(npy_folder + '/' + file, output_folder + '/' + get_output_name(file), verify, force)
+             for file in sorted(os.listdir(npy_folder)) if file.endswith('.npy')]
+
+    counts = {'compressed': 0, 'verified': 0, 'skipped': 0}
+    if num_workers <= 1:
+        for task in tasks:
+            print('Compressing ', os.path.basename(task[0]), '...', end='', sep='')
+            _, status = compress_file(*task)
+            counts[status] += 1
+            print(' Skipped (up to date)' if status == 'skipped' else ' Done!')
+    else:
+        with Pool(num_workers) as pool:
+            for file, status in tqdm(pool.imap_unordered(compress_file_worker, tasks), total=len(tasks)):
+                counts[status] += 1
+                if status != 'skipped':
+                    tqdm.write('Compressed ' + file + (' (verified)' if status == 'verified' else ''))
+
+    print(counts['compressed'] + counts['verified'], 'files compressed (', counts['verified'], 'verified ),',
+          counts['skipped'], 'up to date')
 
 
 if __name__ == '__main__':
-    compress_npy(sys.argv[1])
+    # Create the argument parser
+    parser = argparse.ArgumentParser(
+        prog='compress_numpy.py',
+        description='Compresses all the .npy files of a folder to the .npz format, under the \'feats\' key.'
+    )
+
+    # Define the arguments needed
+    parser.add_argument('NpyFolder', help="Folder with the .npy files")
+    parser.add_argument('--output', default=None, help="Folder where the .npz files will be saved (default: the same "
+                                                       "folder)")
+    parser.add_argument('--workers', type=int, default=1, help="Number of files compressed in parallel")
+    parser.add_argument('--verify', action='store_true', help="Read back each file and compare its checksum")
+    parser.add_argument('--force', action='store_true', help="Compress the files even if they are up to date")
+
+    # Parse the arguments
+    args = parser.parse_args()
+    compress_npy(args.NpyFolder, args.output, args.workers, args.verify, args.force)
@@ -20,172 +20,143 @@
 # In the field segment, we have to specify the starting and ending times of the action in <seconds>:<hundreths>
 #   We can extract those from the start_timestamp and stop_timestamp fields
 
-# Usage: python convert-annotations.py <input annotations> <video info file> <output name>
+# Usage: python convert-annotations.py <input annotations> <video info file> <output name> [--chunkSize <rows>]
 # input annotations: path to the csv file with the action annotations used for MotionFormer
 # video info file: path to the json file containing the video metadata (id, filename, resolution, duration, subset, ...)
 
-import sys
-import csv
+# The csv file is read in chunks of rows, timestamps are converted a whole column at a time, and the rows are grouped by
+# video (in order of first appearance) once all the chunks are read, so both json files are built in a single pass.
+# Besides the json files, the annotations are also saved in columnar form to <output name>_nouns|verbs.npz, with one
+# array per field: video_id, start, stop and label (one entry per annotation), plus videos, duration, resolution and
+# subset (one entry per video). These files can be used as the json_file of the epic dataset and of the evaluator.
+
+import argparse
 import json
 
+import numpy as np
+import pandas as pd
+
 
-# Converts an HH:MM:SS:HH timestamp to SS:HH
-def get_seconds(timestamp):
-    splits = timestamp.split(':')
-    hours = float(splits[0])
-    minutes = float(splits[1])
-    seconds = float(splits[2])
-    return str(hours * 3600 + minutes * 60 + seconds)
+# Converts a column of HH:MM:SS.HH timestamps to seconds
+def get_seconds(timestamps):
+    splits = timestamps.str.split(':', expand=True).astype(float)
+    return (splits[0] * 3600 + splits[1] * 60 + splits[2]).to_numpy()
 
 
 # Loads each videos metadata (id, filename, resolution, duration, subset and framerate) from a json file
 # Returns a dictionary with the video id as a key, its duration, resolution and subset as values
 def load_video_info(input_path):
     # Load json video info file
-    video_info = open(input_path)
-    videos = json.load(video_info)
+    with open(input_path) as video_info:
+        videos = json.load(video_info)
 
     video_dict = {}
 
     # Create a dictionary with the video id as key, duration, resolution and subset as values
-    for v in range(len(videos)):
-        video_id = videos[v]['id']
-        video_duration = videos[v]['duration']
-        video_resolution = str(videos[v]['width']) + 'x' + str(videos[v]['height'])
-        video_subset = videos[v]['subset']
-
-        video_dict[video_id] = {
-            "duration": video_duration,
-            "resolution": video_resolution,
-            "subset": video_subset
+    for video in videos:
+        video_dict[video['id']] = {
+            "duration": video['duration'],
+            "resolution": str(video['width']) + 'x' + str(video['height']),
+            "subset": video['subset']
         }
 
     return video_dict
 
 
-# Takes the action annotations for a video and saves them in the video dictionary
-# Also updates the already_processed_videos list
-def add_video_annotations(already_processed_videos, noun_annotations, noun_database, prev_video, verb_annotations,
-                          verb_database, vid_list_csv, video_dict):
-    vid_list_csv.write(prev_video + '.mp4\n')
-
-    # Save the video as already processed
-    already_processed_videos.append(str(prev_video))
-
-    # Create two dictionaries with the videos' annotations, its resolution, duration and subset
-    video_dict_nouns = {
-        prev_video: {
-            "annotations": noun_annotations,
-            "resolution": video_dict[prev_video]["resolution"],
-            "duration": video_dict[prev_video]["duration"],
-            "subset": video_dict[prev_video]["subset"]
+# Reads the annotations csv file in chunks of chunk_size rows
+# Returns the video id, start and stop times (in seconds), noun and verb class columns of all the annotations
+# (and the noun and verb names if label_names is set)
+def read_annotations(input_file, chunk_size, label_names=False):
+    label_columns = ['noun_class', 'verb_class'] + (['noun', 'verb'] if label_names else [])
+    columns = {key: [] for key in ['video_id', 'start', 'stop'] + label_columns}
+    chunks = pd.read_csv(input_file, dtype=str, chunksize=chunk_size,
+                         usecols=['video_id', 'start_timestamp', 'stop_timestamp'] + label_columns)
+    for chunk in chunks:
+        columns['video_id'].append(chunk['video_id'].to_numpy())
+        columns['start'].append(get_seconds(chunk['start_timestamp']))
+        columns['stop'].append(get_seconds(chunk['stop_timestamp']))
+        for key in label_columns:
+            columns[key].append(chunk[key].to_numpy())
+    return {key: np.concatenate(values) for key, values in columns.items()}
+
+
+# Groups the rows of each video, videos in order of first appearance and rows in their original order
+# Returns the list of videos and the array of rows of each one of them
+def group_by_video(video_ids):
+    codes, videos = pd.factorize(video_ids)
+    order = np.argsort(codes, kind='stable')
+    groups = np.split(order, np.cumsum(np.bincount(codes, minlength=len(videos)))[:-1])
+    return videos.tolist(), groups
+
+
+# Builds the json database of a label column, and saves the columnar version of the annotations
+def save_database(output_name, version, videos, groups, annotations, label_column, video_dict):
+    starts, stops, labels = annotations['start'], annotations['stop'], annotations[label_column]
+
+    # Create a dictionary for each video with its annotations, its resolution, duration and subset
+    database = dict()
+    for video, rows in zip(videos, groups):
+        database[video] = {
+            "annotations": [{"label": labels[row], "label_id": labels[row], "segment": [starts[row], stops[row]]}
+                            for row in rows.tolist()],
+            "resolution": video_dict[video]["resolution"],
+            "duration": video_dict[video]["duration"],
+            "subset": video_dict[video]["subset"]
         }
-    }
-
-    video_dict_verbs = {
-        prev_video: {
-            "annotations": verb_annotations,
-            "resolution": video_dict[prev_video]["resolution"],
-            "duration": video_dict[prev_video]["duration"],
-            "subset": video_dict[prev_video]["subset"]
-        }
-    }
-
-    # Add the dictionaries to the noun and verb lists
-    noun_database.update(video_dict_nouns)
-    verb_database.update(video_dict_verbs)
-
-
-def convert_annotations(input_file, output_file, video_info_file):
+    with open(output_name + '.json', 'w+') as output:
+        json.dump({"version": version, "database": database}, output)
+
+    # Same annotations, one array per field (grouped by video)
+    rows = np.concatenate(groups)
+    np.savez(
+        output_name + '.npz',
+        version=np.array(version),
+        video_id=annotations['video_id'][rows].astype(str),
+        start=starts[rows],
+        stop=stops[rows],
+        label=labels[rows].astype(np.int64),
+        videos=np.array(videos, dtype=str),
+        duration=np.array([video_dict[video]["duration"] for video in videos], dtype=np.float64),
+        resolution=np.array([video_dict[video]["resolution"] for video in videos], dtype=str),
+        subset=np.array([video_dict[video]["subset"] for video in videos], dtype=str)
+    )
+
+
+def convert_annotations(input_file, output_file, video_info_file, chunk_size=100000):
     # Load video information
     video_dict = load_video_info(video_info_file)
 
-    # Output file names, one for noun annotations, one for verb annotations
-    output_file_nouns = output_file + "_nouns.json"
-    output_file_verbs = output_file + "_verbs.json"
+    # Read the input csv annotations file
+    annotations = read_annotations(input_file, chunk_size)
 
-    # Open the input csv annotations file
-    file = open(input_file)
-    csv_reader = csv.DictReader(file, delimiter=',')
-
-    # Previous video's name
-    prev_video = ""
-
-    # List of previously processed videos
-    already_processed_videos = []
-
-    # List of noun/verb annotations in a video
-    noun_annotations = []
-    verb_annotations = []
-
-    # List of noun/verb information from different videos
-    noun_database = dict()
-    verb_database = dict()
+    # Group the rows of each video
+    videos, groups = group_by_video(annotations['video_id'])
 
     # Create the vid_list.csv file
-    vid_list_csv = open('video_annotations/vid_list.csv', 'w+')
-
-    for row in csv_reader:
-        # If we read an action corresponding to a new video
-        if prev_video != row["video_id"]:
-            # If the video has already been processed, we append the new annotations to the existing ones
-            if prev_video in already_processed_videos:
-                noun_database[prev_video]['annotations'].extend(noun_annotations)
-                verb_database[prev_video]['annotations'].extend(verb_annotations)
-
-            # If the last video was not empty, we save its annotations
-            elif prev_video != "":
-                # Output the videos' name to the vid_list.csv
-                add_video_annotations(already_processed_videos, noun_annotations, noun_database, prev_video,
-                                      verb_annotations, verb_database, vid_list_csv, video_dict)
-
-            # Get the new videos' name, create empty annotation lists
-            prev_video = row["video_id"]
-            noun_annotations = []
-            verb_annotations = []
-
-        # Save the annotation in the nouns and the verbs list
-        noun_id = row["noun_class"]
-        verb_id = row["verb_class"]
-        start_time = row["start_timestamp"]
-        stop_time = row["stop_timestamp"]
-
-        # Change timestamps from HH:MM:SS.HH to SS.HH
-        start_time = float(get_seconds(start_time))
-        stop_time = float(get_seconds(stop_time))
-
-        # Build a dictionary with the noun annotation
-        noun_dict = {
-            "label": noun_id,
-            "label_id": noun_id,
-            "segment": [start_time, stop_time]
-        }
-        # Append the dictionary to the videos' list
-        noun_annotations.append(noun_dict)
-
-        # Build a dictionary with the verb annotation
-        verb_dict = {
-            "label": verb_id,
-            "label_id": verb_id,
-            "segment": [start_time, stop_time]
-        }
-        # Append the dictionary to the videos' list
-        verb_annotations.append(verb_dict)
-
-    # Append the last video's annotations
-    add_video_annotations(already_processed_videos, noun_annotations, noun_database, prev_video, verb_annotations,
-                          verb_database, vid_list_csv, video_dict)
-
-    # Create and write the final json files for noun and verb annotations
-    noun_database_complete = {"version": output_file + "_noun", "database": noun_database}
-    verb_database_complete = {"version": output_file + "_verb", "database": verb_database}
+    with open('video_annotations/vid_list.csv', 'w+') as vid_list_csv:
+        for video in videos:
+            vid_list_csv.write(video + '.mp4\n')
 
-    noun_output = open(output_file_nouns, 'w+')
-    json.dump(noun_database_complete, noun_output, indent=2)
-    verb_output = open(output_file_verbs, 'w+')
-    json.dump(verb_database_complete, verb_output, indent=2)
-    vid_list_csv.close()
+    # Create and write the final json (and columnar) files for noun and verb annotations
+    save_database(output_file + "_nouns", output_file + "_noun", videos, groups, annotations, 'noun_class',
+                  video_dict)
+    save_database(output_file + "_verbs", output_file + "_verb", videos, groups, annotations, 'verb_class',
+                  video_dict)
 
 
 if __name__ == "__main__":
-    convert_annotations(sys.argv[1], sys.argv[2], sys.argv[3])
+    # Create the argument parser
+    parser = argparse.ArgumentParser(
+        prog='convert-annotations.py',
+        description='Converts action annotations in MotionFormer\'s format (csv) to ActionFormer\'s (json)'
+    )
+
+    # Define the arguments needed
+    parser.add_argument('InputAnnotations', help="Csv file with the action annotations used for MotionFormer")
+    parser.add_argument('VideoInfoFile', help="Json file with the video metadata")
+    parser.add_argument('OutputName', help="Prefix of the output files (<output name>_nouns|verbs.json|npz)")
+    parser.add_argument('--chunkSize', type=int, default=100000, help="Number of csv rows read at a time")
+
+    # Parse the arguments
+    args = parser.parse_args()
+    convert_annotations(args.InputAnnotations, args.OutputName, args.VideoInfoFile, args.chunkSize)
@@ -27,67 +27,152 @@
 # ]
 
 # Execute with:
-# python process-videos.py <path to video folder> <output_file> <training_set_chance>
+# python process-videos.py <path to video folder> <output_file> <training_set_chance> [--workers <number of processes>]
+#   [--cacheFile <json file>]
 
-import sys
+# The metadata of the videos is probed in parallel by a pool of worker processes, and cached with the size and
+# modification time of each file (<output_file>.cache.json by default). Videos already listed in the output file keep
+# their id and subset, so a rerun only probes the new or changed videos, and new videos get the next free ids.
+
+import argparse
 import json
 import cv2
 import random
 import os
+from multiprocessing import Pool
+
+
+# Opens a video to get its framerate, duration and resolution
+# Requires opencv
+def probe_video(video_path):
+    video = cv2.VideoCapture(video_path)
+    total_frames = video.get(cv2.CAP_PROP_FRAME_COUNT)
+    fps = int(video.get(cv2.CAP_PROP_FPS))
+    total_seconds = total_frames / fps
+
+    height = int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    width = int(video.get(cv2.CAP_PROP_FRAME_WIDTH))
+    video.release()
+
+    return {"framerate": fps, "duration": total_seconds, "height": height, "width": width}
+
+
+# Worker entry point for the process pool
+def probe_video_worker(video_path):
+    return video_path, probe_video(video_path)
+
+
+# Size and modification time of a file (both are kept when the file is renamed)
+def get_file_signature(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+# Loads a json file, or returns the default value if it does not exist
+def load_json(file_name, default):
+    if not os.path.exists(file_name):
+        return default
+    with open(file_name) as json_file:
+        return json.load(json_file)
+
+
+# Saves a json file, written to a temporary file first so a crash never leaves a corrupted file
+def save_json(file_name, data):
+    with open(file_name + '.tmp', 'w') as json_file:
+        json.dump(data, json_file)
+    os.replace(file_name + '.tmp', file_name)
 
 
 # Processes video information from video_folder, video ids are specified in video_annotations
 # The training_set_chance indicates how likely a video is to be classified as a training set video
-def process_videos(video_folder, output_file_name, training_set_chance: int = 80):
+# Videos are probed by num_workers processes, and their metadata is cached in cache_file (see above)
+def process_videos(video_folder, output_file_name, training_set_chance: int = 80, num_workers=1, cache_file=None):
+    if cache_file is None:
+        cache_file = output_file_name + '.cache.json'
+    cache = load_json(cache_file, {})
+
     # Read all the video files' names from the input folder
     video_names = os.listdir(video_folder)
 
+    # Videos from a previous run have already been renamed to their id
+    previous_videos = {video['id'] + '.mp4': video for video in load_json(output_file_name, [])}
+    last_number = max([int(video['id'].split('_')[1]) for video in previous_videos.values()], default=0)
+
+    # Only probe the videos that are not cached, or have changed since then
+    to_probe = [video_folder + '/' + video_name for video_name in video_names
+                if video_name not in cache or cache[video_name]['signature'] !=
+                get_file_signature(video_folder + '/' + video_name)]
+    if num_workers <= 1:
+        probed = dict(map(probe_video_worker, to_probe))
+    else:
+        with Pool(num_workers) as pool:
+            probed = dict(pool.imap_unordered(probe_video_worker, to_probe))
+    print('Probed', len(to_probe), 'videos,', len(video_names) - len(to_probe), 'cached')
+
     # Video data list
     video_list = []
 
     # Process each video
-    for video_number in range(1, len(video_names) + 1):
-        # Extract information from the annotations file
-        video_id = 'P01_' + str(video_number)
-        video_name = video_names[video_number - 1]
+    for video_name in video_names:
         video_path = video_folder + '/' + video_name
-
-        # Open the video to get its framerate, duration and resolution
-        # Requires opencv
-        video = cv2.VideoCapture(video_path)
-        total_frames = video.get(cv2.CAP_PROP_FRAME_COUNT)
-        fps = int(video.get(cv2.CAP_PROP_FPS))
-        total_seconds = total_frames / fps
-
-        height = int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        width = int(video.get(cv2.CAP_PROP_FRAME_WIDTH))
-
-        # Randomly choose if the video will be in the training or validation subset
-        subset = 'training'
-        if random.randint(0, 101) > int(training_set_chance):
-            subset = 'validation'
-        video.release()
-
-        # Create a dictionary for the video and append it to the video list
-        video_dict = {
-            "id": video_id,
-            "name": video_name,
-            "framerate": fps,
-            "duration": total_seconds,
-            "height": height,
-            "width": width,
-            "subset": subset
-        }
-        video_list.append(video_dict)
-
-        # Change the videos' name to the one we will use for the feature extractor
-        os.rename(video_path, video_folder + '/' + video_id + '.mp4')
+        if video_path in probed:
+            metadata = probed[video_path]
+        else:
+            metadata = cache[video_name]['metadata']
+
+        if video_name in previous_videos:
+            # Keep its id, original name and subset
+            video_dict = dict(previous_videos[video_name])
+            video_dict.update(metadata)
+        else:
+            last_number += 1
+            video_id = 'P01_' + str(last_number)
+
+            # Randomly choose if the video will be in the training or validation subset
+            subset = 'training'
+            if random.randint(0, 101) > int(training_set_chance):
+                subset = 'validation'
+
+            # Create a dictionary for the video
+            video_dict = {
+                "id": video_id,
+                "name": video_name,
+                "subset": subset
+            }
+            video_dict.update(metadata)
+
+            # Change the videos' name to the one we will use for the feature extractor
+            os.rename(video_path, video_folder + '/' + video_id + '.mp4')
+
+        # Append it to the video list, and cache it with its new name
+        video_list.append({key: video_dict[key] for key in
+                           ["id", "name", "framerate", "duration", "height", "width", "subset"]})
+        new_name = video_dict['id'] + '.mp4'
+        cache[new_name] = {'signature': get_file_signature(video_folder + '/' + new_name), 'metadata': metadata}
+
+    # Drop the cache entries of videos that are no longer in the folder
+    cache = {video['id'] + '.mp4': cache[video['id'] + '.mp4'] for video in video_list}
+    save_json(cache_file, cache)
 
     # Output all the video data to a json file
-    output_file = open(output_file_name, 'w+')
-    json.dump(video_list, output_file)
+    save_json(output_file_name, video_list)
 
 
 if __name__ == "__main__":
-    process_videos(sys.argv[1], sys.argv[2], sys.argv[3])
-
+    # Create the argument parser
+    parser = argparse.ArgumentParser(
+        prog='process-videos.py',
+        description='Stores the information of each video in a json file, and renames the videos to their ids.'
+    )
+
+    # Define the arguments needed
+    parser.add_argument('VideoFolder', help="Folder with the videos")
+    parser.add_argument('OutputFile', help="Json file where the video information will be saved")
+    parser.add_argument('TrainingSetChance', type=int, help="Chance (0 to 100) of a video to be in the training set")
+    parser.add_argument('--workers', type=int, default=1, help="Number of videos probed in parallel")
+    parser.add_argument('--cacheFile', default=None, help="Json file with the cached metadata of the videos "
+                                                          "(default: <output file>.cache.json)")
+
+    # Parse the arguments
+    args = parser.parse_args()
+    process_videos(args.VideoFolder, args.OutputFile, args.TrainingSetChance, args.workers, args.cacheFile)
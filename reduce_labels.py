@@ -0,0 +1,115 @@
+# Guillermo Enguita Lahoz, 801618
+
+"""
+    This script takes as input a CSV action annotation file (MotionFormer's format) and builds the noun and verb
+    annotation files of a reduced label space in a single pass (it replaces reduce_label_range.py followed by
+    remove_unused_actions.py). Each label type is remapped with a map of old ids to new ids: either given as a csv file
+    (label_name, old_id, new_id), or built from the labels used in the annotations, giving them new ids from 0 to
+    number of labels - 1 in order of first appearance. Annotations whose class is not in the map are removed, as well
+    as the videos left without annotations (for nouns and verbs independently).
+
+    The annotations are loaded as columnar arrays, and the maps are applied to whole columns at a time. The output
+    files are the same ones written by convert-annotations.py (<output name>_nouns|verbs.json|npz), plus the label maps
+    used, <output name>_noun|verb_labels.csv.
+
+    Usage: python reduce_labels.py <input annotations> <video info file> <output name> [--nounLabels <csv file>]
+        [--verbLabels <csv file>]
+"""
+
+import argparse
+import importlib
+
+import numpy as np
+import pandas as pd
+
+# Shares the readers and writers of convert-annotations.py
+convert_annotations = importlib.import_module('convert-annotations')
+
+
+# Loads a map of label ids from a csv file (label_name, old_id, new_id)
+# Returns the old ids, new ids and label names as arrays
+def load_label_map(labels_file):
+    labels = pd.read_csv(labels_file, dtype={'label_name': str, 'old_id': np.int64, 'new_id': np.int64})
+    return labels['old_id'].to_numpy(), labels['new_id'].to_numpy(), labels['label_name'].to_numpy()
+
+
+# Builds a map of label ids giving the labels used a new id from 0 to number of labels - 1, in order of first appearance
+def build_label_map(label_ids, label_names):
+    old_ids, first_rows = np.unique(label_ids, return_index=True)
+    order = np.argsort(first_rows)
+    return old_ids[order], np.arange(len(old_ids), dtype=np.int64), label_names[first_rows[order]]
+
+
+# Maps a column of label ids using a lookup table, labels that are not in the map are given a -1
+def apply_label_map(label_ids, old_ids, new_ids):
+    lookup = np.full(max(label_ids.max(), old_ids.max()) + 1, -1, dtype=np.int64)
+    lookup[old_ids] = new_ids
+    return lookup[label_ids]
+
+
+# Saves a map of label ids to a csv file
+def save_label_map(labels_file, old_ids, new_ids, label_names):
+    pd.DataFrame({'label_name': label_names, 'old_id': old_ids, 'new_id': new_ids}).to_csv(labels_file, index=False)
+
+
+def reduce_labels(input_file, video_info_file, output_file, noun_labels_file=None, verb_labels_file=None,
+                  chunk_size=100000):
+    # Load video information and the annotations (with the label names)
+    video_dict = convert_annotations.load_video_info(video_info_file)
+    annotations = convert_annotations.read_annotations(input_file, chunk_size, label_names=True)
+    videos, groups = convert_annotations.group_by_video(annotations['video_id'])
+
+    for label_type, labels_file in [('noun', noun_labels_file), ('verb', verb_labels_file)]:
+        label_ids = annotations[label_type + '_class'].astype(np.int64)
+        if labels_file is not None:
+            old_ids, new_ids, label_names = load_label_map(labels_file)
+        else:
+            old_ids, new_ids, label_names = build_label_map(label_ids, annotations[label_type])
+        new_label_ids = apply_label_map(label_ids, old_ids, new_ids)
+
+        # Keep the annotations in the new range, and the videos that still have any
+        keep = new_label_ids >= 0
+        kept_videos, kept_groups = [], []
+        for video, rows in zip(videos, groups):
+            rows = rows[keep[rows]]
+            if len(rows) > 0:
+                kept_videos.append(video)
+                kept_groups.append(rows)
+            else:
+                print("No", label_type, "annotations for", video)
+
+        # Labels are written as strings to the json file, like the original ones
+        reduced = dict(annotations)
+        reduced[label_type + '_class'] = new_label_ids.astype(str)
+        convert_annotations.save_database(output_file + '_' + label_type + 's', output_file + '_' + label_type,
+                                          kept_videos, kept_groups, reduced, label_type + '_class', video_dict)
+        save_label_map(output_file + '_' + label_type + '_labels.csv', old_ids, new_ids, label_names)
+        print(label_type.capitalize() + 's:', len(old_ids), 'labels,', int(keep.sum()), 'of', len(keep),
+              'annotations and', len(kept_videos), 'of', len(videos), 'videos kept')
+
+
+if __name__ == "__main__":
+    # Create the argument parser
+    parser = argparse.ArgumentParser(
+        prog='reduce_labels.py',
+        description='This script takes as input a CSV action annotation file, and outputs the noun and verb annotation '
+                    'files with a reduced label range, given by two csv files with the old and new id of each label, or '
+                    'ranging from 0 to number of labels - 1. Annotations outside of the range, and videos without '
+                    'annotations, are removed. It will also output two csv files with the label names, their original '
+                    'ids and their new ids.'
+    )
+
+    # Define the arguments needed
+    parser.add_argument('InputAnnotations', help="CSV action annotations file")
+    parser.add_argument('VideoInfoFile', help="Json file with the video metadata")
+    parser.add_argument('OutputName', help="Prefix of the output files")
+    parser.add_argument('--nounLabels', default=None,
+                        help="CSV file that indicates the nouns used, as well as their old and new ids")
+    parser.add_argument('--verbLabels', default=None,
+                        help="CSV file that indicates the verbs used, as well as their old and new ids")
+    parser.add_argument('--chunkSize', type=int, default=100000, help="Number of csv rows read at a time")
+
+    # Parse the arguments
+    args = parser.parse_args()
+    reduce_labels(args.InputAnnotations, args.VideoInfoFile, args.OutputName, args.nounLabels, args.verbLabels,
+                  args.chunkSize)
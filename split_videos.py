@@ -1,103 +1,379 @@
 # Guillermo Enguita Lahoz 801618
 # This script splits all videos in a specified folder in clips of length given by clip_size.
 # All the clips will be stored in new directories created after each video, and their paths will be specified in the
-# video clip list file.
+# video clip list file. A clip starts every stride frames, and the frames left after the last full clip are written as
+# a last clip padded by repeating the last frame of the video.
 # Execute with:
-# python split_videos.py <video folder> <video clip list file> <clip size in frames> <frame stride>
+# python split_videos.py <video folder> <video clip list file> <clip size in frames> <frame stride> [--manifest]
+#   [--workers <number of processes>] [--completionFile <json file>] [--legacyWindows]
+
+# Finished videos are recorded with their size, modification time and clip count in a completion manifest, by default
+# <video clip list file>.done.json. Rerunning the script only splits the videos that are new or have changed.
+
+# With --manifest, no clip is re-encoded. Instead, the video clip list file becomes a manifest with one window per row:
+#   <video path>,<start frame>,<end frame>
+# where end frame is exclusive and may go past the end of the video (the last frame is then repeated as padding).
+# The frames of each window can be decoded on demand with the ClipRangeReader class (or read_clip_manifest), they are the
+# same frames as the ones of the clips written without --manifest.
+
+# The clip windowing changed with the clip manifest: before, every clip after the first one started one frame early
+# and skipped the last frame of the previous clip. Clips (and their features) split with the old windowing do not match
+# the new ones, and videos recorded as split with the old windowing are split again (with a warning). --legacyWindows
+# keeps the old windowing, so existing feature sets can be reproduced.
 
 from tqdm import tqdm
+import argparse
+import csv
 import glob
+import json
 import os
-import sys
-from math import floor
+from collections import deque
+from multiprocessing import Pool
 import cv2
 
 
+# Computes the (start_frame, end_frame) windows that cover a video of total_frames frames, end_frame is exclusive
+# Every full window starts stride frames after the previous one, the trailing frames are covered by a last window that
+# will be padded by repeating the last frame of the video
+def get_clip_windows(total_frames, clip_size, stride):
+    windows = []
+    start = 0
+    while start + clip_size <= total_frames:
+        windows.append((start, start + clip_size))
+        start += stride
+
+    # Trailing frames not covered by any full window (or a video shorter than a clip)
+    last_end = windows[-1][1] if len(windows) > 0 else 0
+    if start < total_frames and last_end < total_frames:
+        windows.append((start, start + clip_size))
+
+    return windows
+
+
+# Writes the clip windows of every video in the folder to the manifest file, without decoding or encoding any frame
+def write_clip_manifest(videos, video_list_file, clip_size, stride):
+    with open(video_list_file, 'w+', newline='') as manifest:
+        writer = csv.writer(manifest)
+        for video_num, video in enumerate(videos, start=1):
+            print('Indexing ', os.path.basename(video), ' (', video_num, '/', len(videos), ')', sep='')
+
+            # Only the frame count is needed, read from the container metadata
+            video_capture = cv2.VideoCapture(video)
+            total_frames = int(video_capture.get(cv2.CAP_PROP_FRAME_COUNT))
+            video_capture.release()
+
+            for start_frame, end_frame in get_clip_windows(total_frames, clip_size, stride):
+                writer.writerow([video, start_frame, end_frame])
+
+
+# Reads a clip manifest file, returns a list of (video path, start frame, end frame) tuples
+def load_clip_manifest(manifest_file):
+    with open(manifest_file, newline='') as manifest:
+        return [(row[0], int(row[1]), int(row[2])) for row in csv.reader(manifest) if len(row) == 3]
+
+
+# Decodes the frames of a window of a video on demand
+# The capture is kept open between calls, and the frames that overlap with the previous window are kept in memory,
+# so reading consecutive overlapping windows decodes every frame of the video only once
+class ClipRangeReader:
+    def __init__(self, video_path):
+        self.video_path = video_path
+        self.video_capture = cv2.VideoCapture(video_path)
+        self.total_frames = int(self.video_capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        # Index of the next frame the capture will decode
+        self.next_frame = 0
+        # Decoded frames kept from the previous window, and the index of the first one
+        self.buffer = deque()
+        self.buffer_start = 0
+
+    # Returns the frames in [start_frame, end_frame), repeating the last decoded frame if the video ends before
+    def read(self, start_frame, end_frame):
+        # Drop the buffered frames before the window, or everything if the window does not overlap with the buffer
+        buffer_end = self.buffer_start + len(self.buffer)
+        if start_frame < self.buffer_start or start_frame > buffer_end:
+            self.buffer.clear()
+            self.buffer_start = start_frame
+        else:
+            while self.buffer_start < start_frame and len(self.buffer) > 0:
+                self.buffer.popleft()
+                self.buffer_start += 1
+
+        # Seek only if the next frame to decode is not the one we need
+        first_missing = self.buffer_start + len(self.buffer)
+        if self.next_frame != first_missing:
+            self.video_capture.set(cv2.CAP_PROP_POS_FRAMES, first_missing)
+            self.next_frame = first_missing
+
+        # Decode the missing frames of the window
+        while self.buffer_start + len(self.buffer) < end_frame:
+            success, frame = self.video_capture.read()
+            if not success:
+                break
+            self.buffer.append(frame)
+            self.next_frame += 1
+
+        frames = list(self.buffer)[:end_frame - start_frame]
+
+        # Pad with the last frame, as the physical clips do
+        if 0 < len(frames) < end_frame - start_frame:
+            frames.extend([frames[-1]] * (end_frame - start_frame - len(frames)))
+
+        return frames
+
+    def release(self):
+        self.video_capture.release()
+        self.buffer.clear()
+
+
+# Iterates over all the windows of a manifest, yields (video path, start frame, end frame, frames)
+# Windows of the same video are read with the same ClipRangeReader
+def read_clip_manifest(manifest_file):
+    reader = None
+    for video, start_frame, end_frame in load_clip_manifest(manifest_file):
+        if reader is None or reader.video_path != video:
+            if reader is not None:
+                reader.release()
+            reader = ClipRangeReader(video)
+        yield video, start_frame, end_frame, reader.read(start_frame, end_frame)
+
+    if reader is not None:
+        reader.release()
+
+
+# Splits a single video into clips of clip_size frames, stored in the <video name>_clips folder
+# The clips are the windows given by get_clip_windows, decoded with a ClipRangeReader, so they are the same frames
+# listed by the clip manifest
+# Returns the list of the written clip paths
+def split_video(video, clip_size, stride, show_progress=True):
+    # Create the folder for the clips, if needed
+    video_name = os.path.basename(video)
+    video_name = os.path.splitext(video_name)[0]
+    folder_name = video_name + '_clips'
+    if not os.path.exists(folder_name):
+        os.mkdir(folder_name)
+
+    # Instantiate the reader for the current video, and get its clip windows
+    reader = ClipRangeReader(video)
+    windows = get_clip_windows(reader.total_frames, clip_size, stride)
+    clip_paths = []
+
+    for clip_num, (start_frame, end_frame) in enumerate(tqdm(windows, disable=not show_progress), start=1):
+        frames = reader.read(start_frame, end_frame)
+        # The frame count of the metadata can be larger than the decoded frames
+        if len(frames) == 0:
+            break
+
+        # Save the clip
+        rows, cols, _ = frames[0].shape
+        out = cv2.VideoWriter(folder_name + '/' + str(clip_num) + '.mp4', cv2.VideoWriter_fourcc(*'mp4v'), 30,
+                              (cols, rows))
+        for frame in frames:
+            out.write(frame)
+        out.release()
+
+        # Save the clip path for the video clip file
+        clip_paths.append(folder_name + '/' + str(clip_num) + '.mp4')
+
+    reader.release()
+
+    return clip_paths
+
+
+# Splits a single video into clips with the legacy windowing (the one used before the clip manifest), kept so the
+# clips of existing feature sets can be reproduced. After each clip, frames[stride - 1:-1] are kept: the next clip
+# starts at frame stride - 1 of the previous one and skips its last frame, and a padded clip is always written with
+# the frames left at the end of the video. These clips cannot be described by a clip manifest
+# Returns the list of the written clip paths
+def split_video_legacy(video, clip_size, stride, show_progress=True):
+    # Create the folder for the clips, if needed
+    video_name = os.path.basename(video)
+    video_name = os.path.splitext(video_name)[0]
+    folder_name = video_name + '_clips'
+    if not os.path.exists(folder_name):
+        os.mkdir(folder_name)
+
+    # Instantiate the video capture for the current video
+    video_capture = cv2.VideoCapture(video)
+    bar = tqdm(disable=not show_progress)
+    frames = []
+    clip_paths = []
+
+    def write_clip(clip_frames):
+        rows, cols, _ = clip_frames[0].shape
+        out = cv2.VideoWriter(folder_name + '/' + str(len(clip_paths) + 1) + '.mp4', cv2.VideoWriter_fourcc(*'mp4v'),
+                              30, (cols, rows))
+        for clip_frame in clip_frames:
+            out.write(clip_frame)
+        out.release()
+        clip_paths.append(folder_name + '/' + str(len(clip_paths) + 1) + '.mp4')
+        bar.update(1)
+
+    # Read loop
+    success, frame = video_capture.read()
+    while success:
+        frames.append(frame)
+
+        # Write the clip if the number of read frames is equal to the clip size
+        if len(frames) == clip_size:
+            write_clip(frames)
+            frames = frames[stride - 1:-1]
+
+        # Read the next frame
+        success, frame = video_capture.read()
+
+    # Write the last few frames, adding padding to create a full clip
+    if len(frames) != 0:
+        write_clip(frames + [frames[-1]] * (clip_size - len(frames)))
+
+    video_capture.release()
+    bar.close()
+
+    return clip_paths
+
+
+# Worker entry point for the process pool, returns the video path along with its clips
+def split_video_worker(args):
+    video, clip_size, stride, legacy_windows = args
+    split_fn = split_video_legacy if legacy_windows else split_video
+    return video, split_fn(video, clip_size, stride, show_progress=False)
+
+
+# Version of the clip windowing: 1 is the legacy windowing (split_video_legacy), 2 the windows of get_clip_windows
+# Completion entries without a version were written with the legacy windowing
+LEGACY_WINDOWING_VERSION = 1
+WINDOWING_VERSION = 2
+
+
+# Returns the information used to decide whether a video has changed since it was split
+def get_video_signature(video, clip_size, stride, legacy_windows=False):
+    stat = os.stat(video)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime, 'clip_size': clip_size, 'stride': stride,
+            'windowing': LEGACY_WINDOWING_VERSION if legacy_windows else WINDOWING_VERSION}
+
+
+# Loads the completion manifest, a json file with the finished videos, their signature and their clip count
+def load_completion_manifest(manifest_file):
+    if not os.path.exists(manifest_file):
+        return {}
+    with open(manifest_file) as manifest:
+        return json.load(manifest)
+
+
+# Saves the completion manifest, written to a temporary file first so a crash never leaves a corrupted manifest
+def save_completion_manifest(manifest_file, completed):
+    with open(manifest_file + '.tmp', 'w') as manifest:
+        json.dump(completed, manifest)
+    os.replace(manifest_file + '.tmp', manifest_file)
+
+
+# Checks if a video has already been split with the same parameters, and it has not changed since then
+def is_video_complete(video, completed, clip_size, stride, legacy_windows=False):
+    video_name = os.path.splitext(os.path.basename(video))[0]
+    if video not in completed:
+        return False
+    entry = dict(completed[video])
+    entry.setdefault('windowing', LEGACY_WINDOWING_VERSION)
+    signature = get_video_signature(video, clip_size, stride, legacy_windows)
+    if any(entry.get(key) != value for key, value in signature.items()):
+        return False
+    # The clips themselves must still be there
+    last_clip = video_name + '_clips/' + str(entry['num_clips']) + '.mp4'
+    return os.path.exists(last_clip)
+
+
 # Takes all the videos in a folder and splits them into clips of clip_size length
-def split_videos(video_folder, video_list_file, clip_size, stride):
+# The videos are split in parallel by num_workers processes. Every finished video is recorded in a completion manifest
+# (<video list file>.done.json by default), so a rerun only splits new or modified videos
+# If manifest is set, only the clip windows are written to video_list_file (see write_clip_manifest)
+# If legacy_windows is set, the clips are split with the legacy windowing (see split_video_legacy)
+def split_videos(video_folder, video_list_file, clip_size, stride, manifest=False, num_workers=1,
+                 completion_file=None, legacy_windows=False):
     # Process args
     clip_size = int(clip_size)
     stride = int(stride)
-    video_list = open(video_list_file, 'w+')
+    num_workers = max(int(num_workers), 1)
+    if completion_file is None:
+        completion_file = video_list_file + '.done.json'
 
     # List all videos
-    videos = glob.glob(video_folder + '/*.mp4')
+    videos = sorted(glob.glob(video_folder + '/*.mp4'))
 
-    video_num = 1
+    if manifest:
+        if legacy_windows:
+            raise ValueError('The legacy windowing cannot be written as a clip manifest')
+        write_clip_manifest(videos, video_list_file, clip_size, stride)
+        return
 
-    # For every video in the folder
-    for video in videos:
-        # Create the folder for the clips, if needed
-        video_name = os.path.basename(video)
-        video_name = os.path.splitext(video_name)[0]
-        folder_name = video_name + '_clips'
-        if not os.path.exists(folder_name):
-            os.mkdir(folder_name)
+    # Skip the videos that were already split
+    completed = load_completion_manifest(completion_file)
+    pending = [video for video in videos
+               if not is_video_complete(video, completed, clip_size, stride, legacy_windows)]
+    print(len(videos) - len(pending), '/', len(videos), ' videos already split, ', len(pending), ' to process', sep='')
 
-        print('Processing ', video_name, ' (', video_num, '/', len(videos), ')', sep='')
-        video_num += 1
+    # Videos split with the other windowing are split again, their clips (and features) will not match the old ones
+    windowing = LEGACY_WINDOWING_VERSION if legacy_windows else WINDOWING_VERSION
+    resplit = [video for video in pending
+               if video in completed and completed[video].get('windowing', LEGACY_WINDOWING_VERSION) != windowing]
+    if len(resplit) > 0:
+        print('Warning: ', len(resplit), ' videos were split with ',
+              'the new' if legacy_windows else 'the legacy', ' windowing and will be split again',
+              '' if legacy_windows else ' (use --legacyWindows to keep the legacy clips)', sep='')
 
-        # Instantiate the video capture for the current video
-        video_capture = cv2.VideoCapture(video)
+    def mark_complete(video, clip_paths):
+        entry = get_video_signature(video, clip_size, stride, legacy_windows)
+        entry['num_clips'] = len(clip_paths)
+        completed[video] = entry
+        save_completion_manifest(completion_file, completed)
 
-        # Get number of frames and number of clips
-        total_frames = int(video_capture.get(cv2.CAP_PROP_FRAME_COUNT))
-        num_clips = floor(total_frames / stride)
-        bar = tqdm(range(num_clips))
-        frames = []
+    # For every pending video in the folder
+    if num_workers == 1:
+        for video_num, video in enumerate(pending, start=1):
+            print('Processing ', os.path.basename(video), ' (', video_num, '/', len(pending), ')', sep='')
+            split_fn = split_video_legacy if legacy_windows else split_video
+            mark_complete(video, split_fn(video, clip_size, stride))
+    else:
+        with Pool(num_workers) as pool:
+            tasks = [(video, clip_size, stride, legacy_windows) for video in pending]
+            for video_num, (video, clip_paths) in enumerate(pool.imap_unordered(split_video_worker, tasks), start=1):
+                print('Finished ', os.path.basename(video), ' (', video_num, '/', len(pending), ')', sep='')
+                mark_complete(video, clip_paths)
 
-        # Read the first frame
-        success, frame = video_capture.read()
-        clip_num = 1
-
-        # Read loop
-        while success:
-            frames.append(frame)
-
-            # Write the clip if the number of read frames is equal to the clip size
-            if len(frames) == clip_size:
-                rows, cols, _ = frames[0].shape
-                out = cv2.VideoWriter(folder_name + '/' + str(clip_num) + '.mp4', cv2.VideoWriter_fourcc(*'mp4v'), 30,
-                                      (cols, rows))
-                for frame in frames:
-                    out.write(frame)
-                out.release()
-                # frames = []
-                frames = frames[stride - 1:-1]
-
-                # Write the clip path to the video clip file
+    # Write the clip paths of every video to the video clip file
+    with open(video_list_file, 'w+') as video_list:
+        for video in videos:
+            folder_name = os.path.splitext(os.path.basename(video))[0] + '_clips'
+            for clip_num in range(1, completed[video]['num_clips'] + 1):
                 video_list.write(folder_name + '/' + str(clip_num) + '.mp4\n')
-                bar.update(1)
-                bar.refresh()
-                clip_num += 1
-
-            # Read the next frame
-            success, frame = video_capture.read()
-
-        # Write the last few frames, adding padding to create a full clip
-        if len(frames) != 0:
-            # Repeat the last frame the necessary times
-            last_frame = frames[len(frames) - 1]
-            padding_size = clip_size - len(frames)
-            padding = [last_frame] * padding_size
-            frames.extend(padding)
 
-            # Save the clip
-            rows, cols, _ = frames[0].shape
-            out = cv2.VideoWriter(folder_name + '/' + str(clip_num) + '.mp4', cv2.VideoWriter_fourcc(*'mp4v'), 30,
-                                  (cols, rows))
 
-            for frame in frames:
-                out.write(frame)
-            out.release()
-            bar.update(1)
-            bar.refresh()
-
-            video_list.write(folder_name + '/' + str(clip_num) + '.mp4\n')
+if __name__ == "__main__":
+    # Create the argument parser
+    parser = argparse.ArgumentParser(
+        prog='split_videos.py',
+        description='This script splits all videos in a specified folder in clips of length given by clip_size. '
+                    'All the clips will be stored in new directories created after each video, and their paths '
+                    'will be specified in the video clip list file.'
+    )
 
-    video_list.close()
+    # Define the arguments needed
+    parser.add_argument('VideoFolder', help="Folder with the mp4 videos to split")
+    parser.add_argument('VideoListFile', help="Output file with the list of clips (or the clip manifest)")
+    parser.add_argument('ClipSize', type=int, help="Clip size in frames")
+    parser.add_argument('Stride', type=int, help="Number of frames between the start of two consecutive clips")
+    parser.add_argument('--manifest', action='store_true', default=argparse.SUPPRESS,
+                        help="If this flag is set, no clip will be written to disk, the video list file will contain "
+                             "the (video, start frame, end frame) windows to be decoded on demand")
+    parser.add_argument('--legacyWindows', action='store_true', default=argparse.SUPPRESS,
+                        help="Split the clips with the legacy windowing, to reproduce the clips (and features) of "
+                             "videos split before the clip manifest. Not compatible with --manifest")
+    parser.add_argument('--workers', type=int, default=1, help="Number of videos split in parallel")
+    parser.add_argument('--completionFile', default=None,
+                        help="Json file where the finished videos are recorded, so they are skipped in later runs "
+                             "(default: <video clip list file>.done.json)")
 
+    # Parse the arguments
+    args = parser.parse_args()
 
-if __name__ == "__main__":
     print(cv2.getBuildInformation())
-    split_videos(sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4])
+    split_videos(args.VideoFolder, args.VideoListFile, args.ClipSize, args.Stride, "manifest" in args,
+                 args.workers, args.completionFile, "legacyWindows" in args)